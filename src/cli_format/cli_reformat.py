@@ -10,17 +10,34 @@ import io
 from src.output_capture.mp_output import CustomMPOutput
 from datetime import datetime
 from src.ulendohc_core.smartScanCore import *
+from src.ulendohc_core.domainDecomposition import smartScanIslands
+from src.ulendohc_core.timeBudget import TimeBudget
+from src.ulendohc_core.heuristicSequencer import heuristic_sequence
 from src.ulendohc_core.util import *
 from src.exceptions.exceptions import OverLimitException
 
 class CLIReformat:
-    def __init__(self, filepath, output_location, original_name, output_name, progress, selected_material, selected_machine, data=None, feature=2000, mp_output_queue=None):
-        # Configuration parameters
-        self.FACTOR = 1
+    def __init__(self, filepath, output_location, original_name, output_name, progress, selected_material, selected_machine, data=None, feature=2000, mp_output_queue=None,
+                 preset=DEFAULT_PRESET, **solver_options):
+        # Configuration parameters, every solver knob comes from the named preset unless it is passed explicitly
+        self.preset = preset
+        self.settings = solver_preset(preset, **solver_options)
+        self.FACTOR = self.settings["resolution"]
         self.LAYER_GROUP = 10
         self.dx = self.FACTOR  # mm
         self.dy = self.FACTOR  # mm
         self.feature = feature
+        self.objective_layers = self.settings["objective_layers"]  # depth of the layer history
+        self.basis_method = self.settings["basis_method"]  # "eigen" or "pod", how the reduced basis of a layer is built
+        self.layer_time_budget = self.settings["layer_time_budget"]  # seconds per layer, None for unlimited
+        self.job_time_budget = self.settings["job_time_budget"]  # seconds for the whole job, None for unlimited
+        self.heuristic_threshold = self.settings["heuristic_threshold"]  # layers with fewer features skip the reduced model
+        self.heuristic_method = self.settings["heuristic_method"]  # "spread" or "checkerboard"
+        self.greedy_pruning = self.settings["greedy_pruning"]  # None, "exact" or "approximate" candidate pool of the greedy selection
+        self.r_stride = self.settings["r_stride"]  # R metric after every r_stride-th hatch, None to skip it
+        self.precision = self.settings["precision"]  # "double" or "single" precision past the eigensolve
+        self.tile_size_mm = self.settings["tile_size_mm"]  # tile edge of the tiled mode, None to solve every island whole
+        self.tile_workers = self.settings["tile_workers"]  # tile solves running at the same time
         
         self.filelocation = output_location
         self.ori_filename = original_name
@@ -148,6 +165,11 @@ class CLIReformat:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
+        # Every layer is voxelized in the frame of the whole job, cropped to the extent of its
+        # hatches, so the grid stays small for parts away from the origin and the layers stack
+        voxel_bounds = hatch_bounds(list(self.hatch_lines.values())) if self.hatch_lines else None
+        job_budget = TimeBudget(self.job_time_budget)
+
         self.progress['msg'] = f"Creating output file..."
         ori_path = os.path.join("data", self.ori_filename)
         output_file = os.path.join(output_dir, self.opt_filename)
@@ -166,6 +188,9 @@ class CLIReformat:
                         opt_file.write(f"$$HEADEREND\n")
                                 
                     if (layer_num in self.hatch_lines):
+                        layer_budget = None
+                        # What the solve of the layer did, written next to its R metrics
+                        layer_diagnostics = {}
                         self.display_message(f"Total Hatch Lines {self.hatch_lines[layer_num].shape}, at layer {layer_num}")
                         self.display_message(f"Matrix shape {Sorted_layers.shape}, at layer {layer_num}")
                         
@@ -174,36 +199,55 @@ class CLIReformat:
                             R_opt = []
                             R_ori = []
                             
-                        elif self.hatch_lines[layer_num].shape[0] < 3:
-                            optimized_Sequence = self.hatch_lines[layer_num][:, -1]
+                        elif self.hatch_lines[layer_num].shape[0] < max(3, self.heuristic_threshold):
+                            # Too few features for the reduced model to pay off
+                            optimized_Sequence = heuristic_sequence(self.hatch_lines[layer_num], self.heuristic_method)
+                            layer_diagnostics["sequencer"] = f"heuristic {self.heuristic_method}"
                             R_opt = []
                             R_ori = []
                             
                         else:
                             totaltracker = int(self.hatch_lines[layer_num].shape[0]) + totaltracker
                                                 
-                            new_layer, x_size, y_size = convert_hatch_to_voxel(self.hatch_lines[layer_num], 67, 1, 1)   
-                            Objective_layers = 2     
-                            
+                            new_layer, x_offset, y_offset = convert_hatch_to_voxel(self.hatch_lines[layer_num], 67, self.dx, self.dy, bounds=voxel_bounds)
+
+                            Sorted_layers = stack_layers(new_layer, Sorted_layers, self.objective_layers)
 
-                            Sorted_layers = stack_layers(new_layer, Sorted_layers, Objective_layers)
+                            # The job budget is shared out over the layers that are left
+                            layers_left = sum(1 for layer in self.hatch_lines if layer >= layer_num)
+                            layer_budget = job_budget.split(layers_left, cap=self.layer_time_budget)
 
                             try:
-                                optimized_Sequence, v0_evInit, R_opt, R_ori = smartScanCore(numbers_set=self.hatch_lines[layer_num], 
-                                                                                            Sorted_layers=Sorted_layers, 
-                                                                                            dx=self.dx, dy=self.dy, 
-                                                                                            reduced_order=50, 
-                                                                                            kt=float(self.selected_material['kt']),
-                                                                                            rho=float(self.selected_material['rho']),
-                                                                                            cp=float(self.selected_material['cp']),
-                                                                                            vs=float(self.selected_machine['vs']),
-                                                                                            h=float(self.selected_material['h']),
-                                                                                            P=float(self.selected_machine['P']),
-                                                                                            v0_ev=v0_evInit
-                                                                                            )  
+                                optimized_Sequence, v0_evInit, R_opt, R_ori = smartScanIslands(numbers_set=self.hatch_lines[layer_num], 
+                                                                                               Sorted_layers=Sorted_layers, 
+                                                                                               dx=self.dx, dy=self.dy, 
+                                                                                               reduced_order=self.settings["reduced_order_max"], 
+                                                                                               min_order=self.settings["reduced_order_min"],
+                                                                                               kernel_samples=self.settings["kernel_samples"],
+                                                                                               eigen_maxiter=self.settings["eigen_maxiter"],
+                                                                                               eigen_retries=self.settings["eigen_retries"],
+                                                                                               basis_method=self.basis_method,
+                                                                                               greedy_pruning=self.greedy_pruning,
+                                                                                               r_stride=self.r_stride,
+                                                                                               precision=self.precision,
+                                                                                               heuristic_method=self.heuristic_method,
+                                                                                               kt=float(self.selected_material['kt']),
+                                                                                               rho=float(self.selected_material['rho']),
+                                                                                               cp=float(self.selected_material['cp']),
+                                                                                               vs=float(self.selected_machine['vs']),
+                                                                                               h=float(self.selected_material['h']),
+                                                                                               P=float(self.selected_machine['P']),
+                                                                                               v0_ev=v0_evInit,
+                                                                                               tile_size=max(1, int(self.tile_size_mm / self.dx)) if self.tile_size_mm else None,
+                                                                                               tile_workers=self.tile_workers,
+                                                                                               diagnostics=layer_diagnostics,
+                                                                                               budget=layer_budget
+                                                                                               )  
                             except Exception as e:
-                                # if unable to find solution just original sequence
-                                optimized_Sequence = self.hatch_lines[layer_num][:, -1]
+                                # if unable to find solution fall back to the heuristic sequence
+                                self.display_message(f"Layer {layer_num} solve failed, using the {self.heuristic_method} heuristic: {e}")
+                                optimized_Sequence = heuristic_sequence(self.hatch_lines[layer_num], self.heuristic_method)
+                                layer_diagnostics["sequencer"] = f"heuristic {self.heuristic_method}, solve failed"
                                 R_opt = 0
                                 R_ori = 0
                         
@@ -215,6 +259,18 @@ class CLIReformat:
                         
                         ori_file.write(f"//R/{R_ori_str}//\n")
                         opt_file.write(f"//R/{R_opt_str}//\n")
+                        for island_R in layer_diagnostics.get("islands", {}).get("R", []):
+                            # A split layer is simulated island by island, every island keeps its own R
+                            ori_file.write(f"//ISLAND_R/{island_R['label']}/{island_R['R_ori']}//\n")
+                            opt_file.write(f"//ISLAND_R/{island_R['label']}/{island_R['R_opt']}//\n")
+                        if layer_budget is not None and layer_budget.hit:
+                            # Stages that gave up accuracy to finish the layer on time
+                            opt_file.write(f"//BUDGET/{layer_budget.summary()}//\n")
+                            self.display_message(f"Layer {layer_num} hit its time budget: {layer_budget.summary()}")
+                        layer_summary = diagnostics_summary(layer_diagnostics)
+                        if layer_summary:
+                            # Sequencer, eigensolver backend and iterations, retry ladder and reduced order of the layer
+                            opt_file.write(f"//DIAG/{layer_summary}//\n")
                         
                         # Access stored per-layer self.data
                         layer_info = self.layer_data[layer_num]
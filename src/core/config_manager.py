@@ -2,6 +2,7 @@ import json
 import os
 from src.utils.io_utils import persistent_path, get_data_dir, get_persistent_output_dir
 from src.utils.constants import config_defaults
+from src.ulendohc_core.util import SOLVER_PRESETS, DEFAULT_PRESET
 
 class ConfigManager:
     def __init__(self):
@@ -34,6 +35,7 @@ class ConfigManager:
                 "output": get_persistent_output_dir(),
                 "license_key": "",
                 "feature": 0,
+                "preset": DEFAULT_PRESET,
                 "active": True
             }
         }
@@ -49,6 +51,18 @@ class ConfigManager:
             self.active_config["feature"] = feature
             self.save_config()
 
+    @property
+    def preset(self):
+        # Configs written before the presets existed run the default preset
+        return self.active_config.get("preset", DEFAULT_PRESET)
+
+    def set_preset(self, preset):
+        if preset not in SOLVER_PRESETS:
+            raise ValueError(f"Unknown preset '{preset}', expected one of {list(SOLVER_PRESETS)}")
+        if preset != self.preset:
+            self.active_config["preset"] = preset
+            self.save_config()
+
     def change_output_dir(self, new_path):
         if new_path:
             self.output_dir = new_path
@@ -11,6 +11,7 @@ from queue import Queue
 from src.core.config_manager import ConfigManager
 from src.core.data_manager import DataManager
 from src.core.processing_manager import ProcessingManager
+from src.ulendohc_core.util import SOLVER_PRESETS
 from src.cli_format.cli_visualizer import CLIVisualizer
 from src.utils.io_utils import persistent_path, resource_path
 from src.output_capture.output_capture import OutputCapture
@@ -94,6 +95,8 @@ class HeatCompensationApp:
         eel.expose(self.get_r_mean_from_data_layer)
         eel.expose(self.get_r_mean_from_opti_layer)
         eel.expose(self.cancel_task)
+        eel.expose(self.get_presets)
+        eel.expose(self.set_preset)
 
     def start(self):
         try:
@@ -149,12 +152,19 @@ class HeatCompensationApp:
         return self.processing.is_running()
     
     # File operations
-    def convert_cli_filepath(self, filepath, filename, material, material_category, machine):
-        return self.processing.convert_cli_filepath(filepath, filename, material, material_category, machine)
+    def convert_cli_filepath(self, filepath, filename, material, material_category, machine, preset=None):
+        return self.processing.convert_cli_filepath(filepath, filename, material, material_category, machine, preset)
     
     # File operations
-    def convert_cli_filecontent(self, filecontent, filename, material, material_category, machine):
-        return self.processing.convert_cli_filecontent(filecontent, filename, material, material_category, machine)
+    def convert_cli_filecontent(self, filecontent, filename, material, material_category, machine, preset=None):
+        return self.processing.convert_cli_filecontent(filecontent, filename, material, material_category, machine, preset)
+
+    # Solver presets, the active one is stored in the config and used when a job does not name one
+    def get_presets(self):
+        return {"presets": list(SOLVER_PRESETS), "active": self.config.preset}
+
+    def set_preset(self, preset):
+        self.config.set_preset(preset)
 
     def get_task_status(self, filename):
         return self.processing.get_task_status(filename)
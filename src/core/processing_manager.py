@@ -41,7 +41,7 @@ class ProcessingManager:
         with open(persistent_path("dictionary.json"), "w") as file:
             json.dump(self.data_output_dict, file)
 
-    def convert_cli_filepath(self, filepath, filename, selected_material, selected_material_category, selected_machine):
+    def convert_cli_filepath(self, filepath, filename, selected_material, selected_material_category, selected_machine, preset=None):
         try:
             # Deserialize if needed
             if isinstance(selected_material, str):
@@ -94,7 +94,8 @@ class ProcessingManager:
                 selected_material=selected_material,
                 selected_machine=selected_machine,
                 feature=features[self.config_manager.active_config["feature"]],
-                mp_output_queue=self.mp_output_queue
+                mp_output_queue=self.mp_output_queue,
+                preset=preset or self.config_manager.preset
             )
             
             self.pools[filename] = Pool()
@@ -112,7 +113,7 @@ class ProcessingManager:
             eel.displayError(tb, "Processing Error")
             return {"status": "error", "message": error_msg}
         
-    def convert_cli_filecontent(self, filecontent, filename, selected_material, selected_material_category, selected_machine):
+    def convert_cli_filecontent(self, filecontent, filename, selected_material, selected_material_category, selected_machine, preset=None):
         try:
             # Deserialize if needed
             if isinstance(selected_material, str):
@@ -165,7 +166,8 @@ class ProcessingManager:
                 selected_material=selected_material,
                 selected_machine=selected_machine,
                 feature=features[self.config_manager.active_config["feature"]],
-                mp_output_queue=self.mp_output_queue
+                mp_output_queue=self.mp_output_queue,
+                preset=preset or self.config_manager.preset
             )
             
             self.pools[filename] = Pool()
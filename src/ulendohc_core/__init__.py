@@ -16,4 +16,13 @@ __all__ = [
     "smartScanCore",           # refers to the 'smartScanCore.py' file - controls the main logic of the application
     "stateMatrixConstruction",      # refers to the code that construct the state matrix     
     "util",      # common utilities across the framework to the 'LPBFWrapper.py' file     
+    "featurePropagators",      # compact per-feature propagators of the reduced order model
+    "heatInputKernel",      # accumulated laser heat input of a feature on the voxel grid
+    "greedySequencer",      # greedy selection of the SmartScan sequence
+    "eigenSolvers",      # eigensolver backends for the reduced order basis
+    "stateCache",      # on-disk cache of system matrices and reduced bases
+    "domainDecomposition",      # per-island solves of layers with disconnected parts
+    "snapshotBasis",      # snapshot POD reduced basis and its benchmark against the eigenpairs
+    "timeBudget",      # wall-clock budget of a layer or a job and the stages it degraded
+    "heuristicSequencer",      # eigen-free spread and checkerboard sequences for small layers and failures
 ]
\ No newline at end of file
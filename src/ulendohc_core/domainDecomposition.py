@@ -0,0 +1,319 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+from src.ulendohc_core.smartScanCore import smartScanCore
+
+from scipy import ndimage
+
+
+def label_islands(Sorted_layers):
+    """
+    Label the connected components of the stacked voxel mask
+
+    Voxels are connected through their faces, across the layers of the stack as well, so two
+    walls that join in a previous layer form one island.
+
+    Args:
+        Sorted_layers (ndarray):
+            N_x x N_y x N_z voxel mask, the newest layer first
+
+    Returns:
+        tuple:
+            N_x x N_y x N_z array of island labels (0 for void) and the number of islands
+    """
+    labels, count = ndimage.label(np.asarray(Sorted_layers) != 0)
+    return labels, count
+
+
+def assign_features(numbers_set, labels):
+    """
+    Island of every hatch, taken at the midpoint of the hatch on the newest layer. Hatches whose
+    midpoint falls on a void voxel go to the nearest island.
+
+    Args:
+        numbers_set (ndarray):
+            Hatch rows [x1, y1, x2, y2, id] in voxel coordinates
+        labels (ndarray):
+            Island labels from label_islands
+
+    Returns:
+        numpy.ndarray:
+            Island label of every hatch row
+    """
+    top = labels[:, :, 0]
+    if not top.any():
+        return np.zeros(numbers_set.shape[0], dtype=int)
+
+    # Label of the closest labelled voxel of the newest layer, for every voxel
+    _, (nearest_x, nearest_y) = ndimage.distance_transform_edt(top == 0, return_indices=True)
+    nearest = top[nearest_x, nearest_y]
+
+    x = np.clip(np.rint((numbers_set[:, 0] + numbers_set[:, 2]) / 2).astype(int), 0, top.shape[0] - 1)
+    y = np.clip(np.rint((numbers_set[:, 1] + numbers_set[:, 3]) / 2).astype(int), 0, top.shape[1] - 1)
+    return nearest[x, y]
+
+
+def interleave_orders(orders):
+    """
+    Merge per-island sequences so the islands are visited in proportion to their size
+
+    Every feature of an island with n features gets the key (j + 0.5) / n from its position j in
+    the island's sequence, the merged sequence sorts by that key. The laser alternates between
+    the islands and every island keeps its own order.
+
+    Args:
+        orders (list):
+            Per-island sequences
+
+    Returns:
+        tuple:
+            Merged sequence and, for every merged position, the island and the position in the
+            island's sequence it came from
+    """
+    keys, islands, positions = [], [], []
+    for island, order in enumerate(orders):
+        n = len(order)
+        keys.append((np.arange(n) + 0.5) / max(n, 1))
+        islands.append(np.full(n, island))
+        positions.append(np.arange(n))
+
+    keys = np.concatenate(keys) if keys else np.zeros(0)
+    islands = np.concatenate(islands) if islands else np.zeros(0, dtype=int)
+    positions = np.concatenate(positions) if positions else np.zeros(0, dtype=int)
+    merge = np.lexsort((islands, keys))
+
+    merged = np.array([orders[i][p] for i, p in zip(islands[merge], positions[merge])], dtype=int)
+    return merged, islands[merge], positions[merge]
+
+
+def _solve_island(numbers_set, Sorted_layers, reduced_order, kwargs):
+    """
+    smartScanCore on one island, at module level so it can run in a process pool. Also returns
+    the diagnostics and the basis of the island, a process pool only hands back return values.
+    """
+    diagnostics = {}
+    set_opt, basis, R_opt, R_ori = smartScanCore(numbers_set=numbers_set, Sorted_layers=Sorted_layers,
+                                                 reduced_order=reduced_order, diagnostics=diagnostics, **kwargs)
+    return np.asarray(set_opt, dtype=int), list(R_opt), list(R_ori), diagnostics, basis
+
+
+def embed_basis(bases, problems, shape):
+    """
+    Place the bases of the island solves in the node space of the whole layer
+
+    The conduction blocks of the islands do not couple, so the island bases side by side span
+    the low modes of the layer and make a warm start for the next layer. Every island node is
+    moved by the origin of its cropped grid, the two ambient nodes map onto the ambient nodes of
+    the layer. The columns are not orthonormal, the warm start runs a Rayleigh-Ritz step on them.
+
+    Args:
+        bases (list):
+            Basis of every island solve in the node space of its cropped grid
+        problems (list):
+            (label, hatch rows, cropped mask, origin) of every island solve
+        shape (tuple):
+            N_x, N_y, N_z of the layer
+
+    Returns:
+        ndarray:
+            (N_x * N_y * N_z) x (total order) basis, None when an island did not return a basis
+    """
+    if any(basis is None or np.ndim(basis) != 2 for basis in bases):
+        return None
+    N_x, N_y, N_z = shape
+    embedded = np.zeros((N_x * N_y * N_z, sum(basis.shape[1] for basis in bases)))
+
+    column = 0
+    for basis, (_, _, mask, (x0, y0)) in zip(bases, problems):
+        nx, ny, nz = mask.shape
+        x, y, z = np.unravel_index(np.arange(nx * ny * nz), (nx, ny, nz))
+        nodes = np.ravel_multi_index((x + x0, y + y0, z), (N_x, N_y, N_z))
+        ambient = np.arange(nx * ny, min(nx * ny + 2, nodes.shape[0]))
+        nodes[ambient] = N_x * N_y + np.arange(ambient.shape[0])
+
+        embedded[nodes, column:column + basis.shape[1]] = basis
+        column += basis.shape[1]
+    return embedded
+
+
+def island_problems(numbers_set, Sorted_layers, labels, features, margin:int = VOXEL_MARGIN):
+    """
+    Crop the mask and the hatches of every island that carries features
+
+    Returns:
+        list:
+            (island label, hatch rows of the island, cropped mask, x, y origin of the crop) per island
+    """
+    problems = []
+    N_x, N_y, _ = Sorted_layers.shape
+    for island in np.unique(features):
+        rows = numbers_set[features == island].copy()
+        xs, ys, _ = np.nonzero(labels == island)
+        x0, y0 = max(xs.min() - margin, 0), max(ys.min() - margin, 0)
+        x1, y1 = min(xs.max() + margin + 1, N_x), min(ys.max() + margin + 1, N_y)
+
+        mask = (labels[x0:x1, y0:y1, :] == island).astype(Sorted_layers.dtype)
+        rows[:, [0, 2]] -= x0
+        rows[:, [1, 3]] -= y0
+        problems.append((island, rows, mask, (x0, y0)))
+    return problems
+
+
+def tile_problems(problem, tile_size:int, overlap:int = TILE_OVERLAP):
+    """
+    Split an island that is wider than a tile into overlapping spatial tiles
+
+    Hatches go to the tile that holds their centroid, every tile keeps overlap voxels of its
+    neighbours so heat still flows across the tile edges. The grid of a tile is at most
+    (tile_size + 2 * overlap) voxels wide whatever the size of the plate.
+
+    Args:
+        problem (tuple):
+            (label, hatch rows, cropped mask, origin) of an island
+        tile_size (int):
+            Edge length of a tile in voxels
+        overlap (int):
+            Voxels added on every side of a tile
+
+    Returns:
+        list:
+            (label, hatch rows, cropped mask, origin) per tile that carries features
+    """
+    label, rows, mask, (origin_x, origin_y) = problem
+    N_x, N_y, _ = mask.shape
+    if N_x <= tile_size + 2 * overlap and N_y <= tile_size + 2 * overlap:
+        return [problem]
+
+    tiles_x = int(np.ceil(N_x / tile_size))
+    tiles_y = int(np.ceil(N_y / tile_size))
+    tile_x = np.clip(((rows[:, 0] + rows[:, 2]) / 2 // tile_size).astype(int), 0, tiles_x - 1)
+    tile_y = np.clip(((rows[:, 1] + rows[:, 3]) / 2 // tile_size).astype(int), 0, tiles_y - 1)
+
+    tiles = []
+    for tx, ty in sorted(set(zip(tile_x.tolist(), tile_y.tolist()))):
+        x0, y0 = max(tx * tile_size - overlap, 0), max(ty * tile_size - overlap, 0)
+        x1, y1 = min((tx + 1) * tile_size + overlap, N_x), min((ty + 1) * tile_size + overlap, N_y)
+
+        tile_rows = rows[(tile_x == tx) & (tile_y == ty)].copy()
+        tile_rows[:, [0, 2]] -= x0
+        tile_rows[:, [1, 3]] -= y0
+        tiles.append((f"{label}:{tx},{ty}", tile_rows, mask[x0:x1, y0:y1, :], (origin_x + x0, origin_y + y0)))
+    return tiles
+
+
+def island_executor(workers:int):
+    """
+    Process pool for the island solves. CLIReformat already runs inside a daemonic pool
+    worker, which may not start child processes, there the islands fall back to threads.
+    """
+    if multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(max_workers=workers), "thread"
+    return ProcessPoolExecutor(max_workers=workers), "process"
+
+
+def smartScanIslands(numbers_set=np.array([]), Sorted_layers=np.array([]), reduced_order:int = 20, v0_ev=None,
+                     diagnostics=None, max_workers=None, tile_size=None, tile_workers:int = TILE_MAX_WORKERS, **kwargs):
+    """
+    Run smartScanCore independently on every connected island of the layer
+
+    The thermal blocks of disconnected islands do not couple, so every island is solved on its
+    own cropped grid and the per-island sequences are interleaved. With tile_size set, islands
+    wider than a tile are further split into overlapping tiles so the memory of every solve
+    stays bounded. A layer with a single island that fits in a tile is passed straight to
+    smartScanCore.
+
+    Args:
+        numbers_set (ndarray):
+            Hatch rows [x1, y1, x2, y2, id] of the layer in voxel coordinates
+        Sorted_layers (ndarray):
+            N_x x N_y x N_z voxel mask, the newest layer first
+        reduced_order (int):
+            Order of the reduced model, capped by the size of every island
+        v0_ev (ndarray):
+            Starting basis or vector, only used when the layer is a single island
+        diagnostics (dict):
+            Optional dictionary, receives the island count and sizes under "islands", the
+            diagnostics of every island solve under "islands" "solves" and the R metrics of
+            every island under "islands" "R"
+        max_workers (int):
+            Number of concurrent island solves, defaults to CPU_COUNT
+        tile_size (int):
+            Optional tile edge length in voxels, enables the tiled mode
+        tile_workers (int):
+            Number of concurrent solves once the layer is tiled, caps max_workers
+        **kwargs:
+            Remaining smartScanCore parameters (dx, dy, material and machine constants)
+
+    Returns:
+        tuple:
+            Same as smartScanCore. The sequence holds positions in numbers_set sorted by id. The
+            basis is the island bases placed side by side in the node space of the layer (see
+            embed_basis), or the v0_ev passed in when an island returned none. Every island is
+            simulated on its own, so a split layer has no R metric of its own: R_opt and R_ori
+            are empty and the metrics of every island are in diagnostics["islands"]["R"].
+    """
+    diagnostics = {} if diagnostics is None else diagnostics
+    labels, count = label_islands(Sorted_layers)
+    features = assign_features(numbers_set, labels) if count > 1 else np.zeros(numbers_set.shape[0], dtype=int)
+
+    fits_tile = tile_size is None or max(Sorted_layers.shape[:2]) <= tile_size + 2 * TILE_OVERLAP
+    if len(np.unique(features)) < 2 and fits_tile:
+        diagnostics["islands"] = {"count": int(count), "features": [int(numbers_set.shape[0])], "executor": "serial"}
+        return smartScanCore(numbers_set=numbers_set, Sorted_layers=Sorted_layers, reduced_order=reduced_order,
+                             v0_ev=v0_ev, diagnostics=diagnostics, **kwargs)
+
+    problems = island_problems(numbers_set, Sorted_layers, labels, features)
+    if tile_size is not None:
+        problems = [tile for problem in problems for tile in tile_problems(problem, tile_size)]
+    # Small islands can not carry the full order, keep at least the two ambient modes
+    orders = [max(2, min(reduced_order, int(mask.sum()))) for _, _, mask, _ in problems]
+
+    # Every island runs against the deadline of the layer and keeps its own budget records
+    budget = kwargs.pop("budget", None)
+    island_kwargs = [dict(kwargs, budget=budget.share()) if budget is not None else kwargs for _ in problems]
+
+    workers = max(1, min(len(problems), max_workers if max_workers else CPU_COUNT))
+    if tile_size is not None and tile_workers:
+        # Every tile is sized to the memory budget of one solve, only a few of them may run at once
+        workers = max(1, min(workers, tile_workers))
+    tic = time.perf_counter()
+    if workers == 1:
+        executor_name = "serial"
+        results = [_solve_island(rows, mask, order, island) for (_, rows, mask, _), order, island in zip(problems, orders, island_kwargs)]
+    else:
+        executor, executor_name = island_executor(workers)
+        with executor:
+            futures = [executor.submit(_solve_island, rows, mask, order, island) for (_, rows, mask, _), order, island in zip(problems, orders, island_kwargs)]
+            results = [future.result() for future in futures]
+    toc = time.perf_counter()
+
+    if budget is not None:
+        for (label, _, _, _), (_, _, _, island_diagnostics, _) in zip(problems, results):
+            budget.merge(island_diagnostics.get("budget"), label=label)
+        diagnostics["budget"] = budget.report()
+
+    diagnostics["islands"] = {"count": len(problems), "features": [int(rows.shape[0]) for _, rows, _, _ in problems],
+                              "orders": orders, "executor": executor_name, "wall_time": toc - tic,
+                              "solves": [island_diagnostics for _, _, _, island_diagnostics, _ in results],
+                              "R": [{"label": str(label), "R_opt": R_opt, "R_ori": R_ori}
+                                    for (label, _, _, _), (_, R_opt, R_ori, _, _) in zip(problems, results)]}
+    debugPrint(f"smartScanIslands - {len(problems)} islands {diagnostics['islands']['features']} on {executor_name} {toc - tic:0.4f} seconds", -1)
+
+    # smartScanCore reports positions in its id-sorted input, map them back to ids of the layer
+    ids = [np.sort(rows[:, 4]) for _, rows, _, _ in problems]
+    orders = [island_ids[set_opt] for island_ids, (set_opt, _, _, _, _) in zip(ids, results)]
+    merged, _, _ = interleave_orders(orders)
+
+    layer_ids = np.sort(numbers_set[:, 4])
+    set_opt = np.searchsorted(layer_ids, merged)
+
+    basis = embed_basis([island_basis for _, _, _, _, island_basis in results], problems, Sorted_layers.shape)
+    return set_opt, v0_ev if basis is None else basis, [], []
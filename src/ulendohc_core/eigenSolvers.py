@@ -0,0 +1,500 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+
+import warnings
+import scipy.linalg
+from scipy.sparse.linalg import LinearOperator, ArpackNoConvergence, lobpcg, splu
+
+# Systems up to this size are solved densely, the factorization is cheaper than any Krylov setup
+DENSE_EIGEN_MAX_SIZE = 2000
+
+# Shift-invert needs a sparse LU of the shifted operator, used while the fill-in stays manageable
+SHIFT_INVERT_MAX_SIZE = 250000
+SHIFT_INVERT_MAX_ROW_NNZ = 16
+
+# Memory the retry ladder may spend on Krylov and LOBPCG blocks, in bytes
+EIGEN_MEMORY_BUDGET = 512 * 2**20
+
+# Retries start from this tolerance and relax it by EIGEN_TOL_RELAXATION on every further rung
+EIGEN_RETRY_TOL = 1e-6
+EIGEN_TOL_RELAXATION = 100
+EIGEN_RETRY_MAXITER = 1000
+
+# A Ritz pair of the last (LOBPCG) rung counts as converged below this residual, relative to the
+# largest absolute row sum of the system matrix
+EIGEN_ACCEPT_TOL = 1e-4
+
+# A recycled basis is accepted once its relative residual is below WARM_START_ACCEPT_TOL, on par
+# with what ARPACK leaves on the (slightly asymmetric) system matrix. Above it the basis gets
+# at most WARM_START_MAXITER LOBPCG iterations before the layer falls back to a cold solve
+WARM_START_ACCEPT_TOL = 1e-4
+WARM_START_MAXITER = 10
+
+# Masks filling at least DCT_FILL_THRESHOLD of their bounding box start from the analytic cosine modes of
+# the grid, DCT_OVERSAMPLE extra modes widen the trial space of the Rayleigh-Ritz step and the
+# refinement gets DCT_REFINE_MAXITER LOBPCG iterations
+DCT_FILL_THRESHOLD = 0.9
+DCT_OVERSAMPLE = 10
+DCT_REFINE_MAXITER = 30
+
+
+class EigenSolverResult():
+    """
+    Lowest eigenpairs of the system matrix together with the cost of computing them
+    """
+
+    def __init__(self, eigenvalues, eigenvectors, backend:str, iterations:int, wall_time:float):
+        self.eigenvalues = eigenvalues
+        self.eigenvectors = eigenvectors
+        self.backend = backend
+        self.iterations = iterations
+        self.wall_time = wall_time
+
+    def report(self):
+        return {"backend": self.backend, "iterations": self.iterations, "wall_time": self.wall_time,
+                "order": int(self.eigenvectors.shape[1])}
+
+
+class EigenSolverBackend():
+    """
+    Base class of the eigensolver backends. Every backend returns the k smallest algebraic
+    eigenpairs of the symmetric system matrix and counts the operator applications it needed.
+    """
+    name = ""
+
+    def solve(self, A, k:int, v0=None, maxiter=None, tol:float = 0, ncv=None):
+        tic = time.perf_counter()
+        eigenvalues, eigenvectors, iterations = self._solve(A, k, v0=v0, maxiter=maxiter, tol=tol, ncv=ncv)
+        toc = time.perf_counter()
+
+        # Sort ascending so every backend hands back the modes in the same order
+        order = np.argsort(eigenvalues)
+        result = EigenSolverResult(eigenvalues[order], eigenvectors[:, order], self.name, iterations, toc - tic)
+        debugPrint(f"{self.name} - k {k} iterations {iterations} time {result.wall_time:0.4f} seconds", -1)
+        return result
+
+    def _solve(self, A, k, v0=None, maxiter=None, tol=0, ncv=None):
+        raise NotImplementedError
+
+
+def _counting_operator(A, counter, matvec=None):
+    """
+    Wrap the system matrix (or a solve) in a LinearOperator that counts its applications.
+    A block of vectors is applied in one product and counted once.
+    """
+    matvec = matvec if matvec is not None else A.dot
+
+    def _matvec(x):
+        counter[0] += 1
+        return matvec(x)
+
+    return LinearOperator(A.shape, matvec=_matvec, matmat=_matvec, dtype=A.dtype)
+
+
+def _spectrum_lower_bound(A):
+    """
+    Gershgorin lower bound of the spectrum of A
+    """
+    A = csr_matrix(A)
+    diagonal = A.diagonal()
+    off_diagonal = np.asarray(abs(A).sum(axis=1)).ravel() - np.abs(diagonal)
+    return float(np.min(diagonal - off_diagonal))
+
+
+class ArpackSolver(EigenSolverBackend):
+    """
+    Implicitly restarted Lanczos (ARPACK) on the smallest algebraic end of the spectrum
+    """
+    name = "arpack"
+
+    def _solve(self, A, k, v0=None, maxiter=None, tol=0, ncv=None):
+        counter = [0]
+        eigenvalues, eigenvectors = eigsh(_counting_operator(A, counter), k, which='SA', v0=v0, ncv=ncv,
+                                          maxiter=maxiter, tol=tol, return_eigenvectors=True)
+        return eigenvalues, eigenvectors, counter[0]
+
+
+class ShiftInvertArpackSolver(EigenSolverBackend):
+    """
+    ARPACK in shift-invert mode. The shift sits below the Gershgorin bound of the spectrum so
+    the smallest algebraic eigenvalues become the dominant ones of (A - sigma I)^-1 and
+    converge in a few iterations, at the cost of one sparse LU.
+    """
+    name = "shift_invert"
+
+    def _solve(self, A, k, v0=None, maxiter=None, tol=0, ncv=None):
+        A = csr_matrix(A)
+        lower = _spectrum_lower_bound(A)
+        sigma = lower - 1e-3 * max(abs(lower), 1)
+        factor = splu((A - sigma * sparse.identity(A.shape[0], format='csr')).tocsc())
+
+        counter = [0]
+        OPinv = _counting_operator(A, counter, matvec=factor.solve)
+        eigenvalues, eigenvectors = eigsh(A, k, sigma=sigma, which='LM', OPinv=OPinv, v0=v0, ncv=ncv,
+                                          maxiter=maxiter, tol=tol, return_eigenvectors=True)
+        return eigenvalues, eigenvectors, counter[0]
+
+
+class LobpcgSolver(EigenSolverBackend):
+    """
+    Block LOBPCG with a Jacobi preconditioner of the shifted operator. Accepts a block of
+    starting vectors, which lets it refine a basis from a neighbouring layer.
+    """
+    name = "lobpcg"
+
+    def _solve(self, A, k, v0=None, maxiter=None, tol=0, ncv=None, X=None):
+        A = csr_matrix(A)
+        n = A.shape[0]
+        lower = _spectrum_lower_bound(A)
+        shifted_diagonal = A.diagonal() - lower + 1e-3 * max(abs(lower), 1)
+        M = sparse.diags(1 / shifted_diagonal)
+
+        if X is None:
+            X = np.random.default_rng(0).standard_normal((n, k))
+            if v0 is not None:
+                X[:, 0] = v0
+        counter = [0]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            eigenvalues, eigenvectors = lobpcg(_counting_operator(A, counter, matvec=A.dot), X, M=M,
+                                               largest=False, tol=tol if tol else None,
+                                               maxiter=maxiter if maxiter else 200)
+        if caught:
+            debugPrint(f"{self.name} - stopped before the requested tolerance after {counter[0]} iterations", 0)
+        return eigenvalues, eigenvectors, counter[0]
+
+    def refine(self, A, X, maxiter=None, tol:float = 0):
+        """
+        Run LOBPCG from an existing block of vectors
+        """
+        tic = time.perf_counter()
+        eigenvalues, eigenvectors, iterations = self._solve(A, X.shape[1], maxiter=maxiter, tol=tol, X=X)
+        toc = time.perf_counter()
+
+        order = np.argsort(eigenvalues)
+        result = EigenSolverResult(eigenvalues[order], eigenvectors[:, order], self.name, iterations, toc - tic)
+        debugPrint(f"{self.name} - refine k {X.shape[1]} iterations {iterations} time {result.wall_time:0.4f} seconds", -1)
+        return result
+
+
+class DenseSolver(EigenSolverBackend):
+    """
+    Dense symmetric eigendecomposition, only meant for tiny systems
+    """
+    name = "dense"
+
+    def _solve(self, A, k, v0=None, maxiter=None, tol=0, ncv=None):
+        if sparse.issparse(A):
+            A = ((A + A.T) / 2).toarray()
+        eigenvalues, eigenvectors = scipy.linalg.eigh(A, subset_by_index=[0, k - 1])
+        return eigenvalues, eigenvectors, 1
+
+
+class WarmStartSolver(EigenSolverBackend):
+    """
+    Recycle the basis of the previous layer. Consecutive layers share most of their voxel
+    mask, so a Rayleigh-Ritz step on the previous r columns already lands on (or close to)
+    the new eigenpairs and a few block LOBPCG iterations finish the job. Works on the
+    symmetric part of the system matrix like the dense backend. v0 is the n x m block of
+    the previous basis, missing columns are padded with random vectors. Raises
+    ArpackNoConvergence when the refined basis is still too far off, the caller then
+    falls back to a cold solve.
+    """
+    name = "warm_start"
+
+    def _solve(self, A, k, v0=None, maxiter=None, tol=0, ncv=None):
+        A = csr_matrix(A)
+        A = ((A + A.T) / 2).tocsr()
+        n = A.shape[0]
+        tol = tol if tol else WARM_START_ACCEPT_TOL
+        scale = max(float(abs(A).sum(axis=1).max()), 1e-300)
+
+        X = np.asarray(v0, dtype=np.float64)
+        if X.shape[1] < k:
+            X = np.hstack((X, np.random.default_rng(0).standard_normal((n, k - X.shape[1]))))
+        eigenvalues, eigenvectors = rayleigh_ritz(A, X, k)
+
+        residual = _max_residual(A, eigenvalues, eigenvectors) / scale
+        debugPrint(f"{self.name} - Rayleigh-Ritz residual {residual:0.3e}", 0)
+        if residual <= tol:
+            return eigenvalues, eigenvectors, 0
+
+        eigenvalues, eigenvectors, iterations = LobpcgSolver()._solve(A, k, maxiter=maxiter if maxiter else WARM_START_MAXITER,
+                                                                      tol=tol * scale / 10, X=eigenvectors)
+        residual = _max_residual(A, eigenvalues, eigenvectors) / scale
+        debugPrint(f"{self.name} - refined residual {residual:0.3e} after {iterations} iterations", 0)
+        if residual > tol:
+            raise ArpackNoConvergence(f"Recycled basis did not converge, residual {residual:0.3e}", eigenvalues, eigenvectors)
+        return eigenvalues, eigenvectors, iterations
+
+
+class CosineModeSolver(WarmStartSolver):
+    """
+    Refine the analytic cosine modes of the grid (stateMatrixConstruction.cosineModes). On a
+    filled rectangular stack the conduction operator is a Kronecker sum of 1-D Neumann
+    Laplacians whose eigenvectors are the DCT-II modes, the Rayleigh-Ritz step and a short
+    LOBPCG run only correct for the convection rows, the ambient nodes and the voids of a
+    nearly filled mask. v0 is the n x m block of trial modes, m > k.
+    """
+    name = "dct"
+
+    def _solve(self, A, k, v0=None, maxiter=None, tol=0, ncv=None):
+        return super()._solve(A, k, v0=v0, maxiter=maxiter if maxiter else DCT_REFINE_MAXITER, tol=tol)
+
+
+def _max_residual(A, eigenvalues, eigenvectors):
+    return float(np.linalg.norm(A @ eigenvectors - eigenvectors * eigenvalues, axis=0).max())
+
+
+def rayleigh_ritz(A, X, k:int):
+    """
+    Lowest k Ritz pairs of A on the span of the columns of X
+
+    Args:
+        A (sparse matrix):
+            The system matrix
+        X (ndarray):
+            n x m block spanning the trial subspace, m >= k
+        k (int):
+            Number of Ritz pairs returned
+
+    Returns:
+        tuple:
+            Ritz values (k,) and orthonormal Ritz vectors (n x k)
+    """
+    Q, _ = np.linalg.qr(X)
+    H = Q.T @ (A @ Q)
+    ritz_values, S = np.linalg.eigh((H + H.T) / 2)
+    return ritz_values[:k], Q @ S[:, :k]
+
+
+EIGEN_SOLVERS = {
+    ArpackSolver.name: ArpackSolver,
+    ShiftInvertArpackSolver.name: ShiftInvertArpackSolver,
+    LobpcgSolver.name: LobpcgSolver,
+    DenseSolver.name: DenseSolver,
+}
+
+
+def select_eigensolver(A, k:int):
+    """
+    Pick an eigensolver backend from the size and sparsity of the system matrix
+
+    Args:
+        A (sparse matrix):
+            The system matrix
+        k (int):
+            Number of eigenpairs requested
+
+    Returns:
+        str:
+            Name of the selected backend
+    """
+    n = A.shape[0]
+    row_nnz = A.nnz / max(n, 1) if sparse.issparse(A) else n
+
+    if n <= DENSE_EIGEN_MAX_SIZE or k >= n - 1:
+        return DenseSolver.name
+    if n <= SHIFT_INVERT_MAX_SIZE and row_nnz <= SHIFT_INVERT_MAX_ROW_NNZ:
+        return ShiftInvertArpackSolver.name
+    return LobpcgSolver.name
+
+
+def get_eigensolver(backend:str, A=None, k:int = 0):
+    """
+    Return an instance of the named backend, "auto" selects one for the given system
+    """
+    if backend == "auto":
+        backend = select_eigensolver(A, k)
+    if backend not in EIGEN_SOLVERS:
+        raise ValueError(f"Unknown eigensolver backend '{backend}', expected one of {list(EIGEN_SOLVERS)} or 'auto'")
+    return EIGEN_SOLVERS[backend]()
+
+
+class EigenRetryLadder():
+    """
+    Solve for the reduced basis, stepping down a ladder of cheaper and looser attempts when
+    the solver does not converge.
+
+    The first rung runs the requested backend. Every retry runs ARPACK with the Krylov basis
+    capped by the memory budget, a tolerance relaxed from EIGEN_RETRY_TOL and an order halved
+    from the second retry on. Ritz vectors that converged before a failure are kept and seed
+    the next rung, the last rung refines them with LOBPCG. The ladder raises when the LOBPCG
+    rung leaves any of its eigenpairs above EIGEN_ACCEPT_TOL.
+
+    Args:
+        backend (str):
+            Backend of the first rung, "auto" selects one from the system matrix
+        memory_budget (int):
+            Bytes the Krylov (or LOBPCG) block of a rung may occupy
+        retries (int):
+            Number of ARPACK retries before the LOBPCG rung
+        maxiter (int):
+            Iteration limit of the first rung
+    """
+
+    def __init__(self, backend:str = "auto", memory_budget:int = EIGEN_MEMORY_BUDGET, retries:int = NUM_RETRIES, maxiter:int = EIGEN_MAXITER):
+        self.backend = backend
+        self.memory_budget = memory_budget
+        self.retries = retries
+        self.maxiter = maxiter
+
+    def max_vectors(self, n:int):
+        """
+        Number of length n float64 vectors that fit in the memory budget
+        """
+        return int(self.memory_budget // (8 * max(n, 1)))
+
+    def krylov_size(self, n:int, k:int, widen:int = 2):
+        """
+        Largest useful ncv for k eigenpairs inside the memory budget, or 0 when not even k + 2 vectors fit
+        """
+        ncv = min(n, self.max_vectors(n), max(widen * k + 1, 20))
+        return ncv if ncv >= k + 2 else 0
+
+    def solve(self, A, k:int, v0=None, diagnostics=None, deadline=None):
+        """
+        Run the ladder until a rung returns k (or fewer, on reduced rungs) eigenpairs
+
+        Args:
+            A (sparse matrix):
+                The system matrix
+            k (int):
+                Requested order of the reduced basis
+            v0 (ndarray):
+                Optional starting vector of the first rung
+            diagnostics (dict):
+                Optional dictionary, receives the report of every rung under "eigensolver_ladder"
+                and of the accepted one under "eigensolver"
+            deadline (float):
+                Optional time.time() value, no further rung is started past it
+
+        Returns:
+            EigenSolverResult:
+                The accepted eigenpairs
+
+        Raises:
+            TimeoutError:
+                The deadline passed before a rung converged
+        """
+        n = A.shape[0]
+        k = int(min(k, n))
+        steps = []
+        if diagnostics is not None:
+            diagnostics["eigensolver_ladder"] = steps
+
+        ritz_vectors = np.zeros((n, 0))
+        error = None
+        order = k
+
+        def check_deadline(rung, backend):
+            if deadline is not None and time.time() >= deadline:
+                steps.append({"rung": rung, "backend": backend, "order": order, "status": "skipped",
+                              "converged": 0, "error": "deadline"})
+                debugPrint(f"EigenRetryLadder - deadline passed before rung {rung}", -1)
+                raise TimeoutError(f"Eigensolve stopped at rung {rung}, the deadline passed") from error
+
+        for rung in range(self.retries + 1):
+            if rung > 0:
+                check_deadline(rung, ArpackSolver.name)
+            if rung == 0:
+                solver = get_eigensolver(self.backend, A, order)
+                tol, maxiter = 0, self.maxiter
+                ncv = self.krylov_size(n, order)
+                if not ncv and solver.name in (ArpackSolver.name, ShiftInvertArpackSolver.name):
+                    steps.append({"rung": rung, "backend": solver.name, "order": order, "status": "skipped",
+                                  "converged": 0, "error": "Krylov basis exceeds the memory budget"})
+                    continue
+                ncv = ncv or None
+            else:
+                # The first retry keeps the order, further retries halve it until the Krylov basis fits
+                if rung > 1:
+                    order = max(1, order // 2)
+                order = min(order, n - 2, max(self.max_vectors(n) - 2, 1))
+                solver = ArpackSolver()
+                tol = EIGEN_RETRY_TOL * EIGEN_TOL_RELAXATION**(rung - 1)
+                maxiter = EIGEN_RETRY_MAXITER
+                ncv = self.krylov_size(n, order, widen=4)
+                if order < 1 or not ncv:
+                    break
+                # Restart from the converged part of the spectrum instead of a random vector
+                v0 = ritz_vectors.sum(axis=1) if ritz_vectors.shape[1] else None
+
+            step = {"rung": rung, "backend": solver.name, "order": order, "ncv": ncv, "tol": tol, "maxiter": maxiter,
+                    "memory": 8 * n * (ncv or order), "seeded": int(ritz_vectors.shape[1]) if rung else 0}
+            tic = time.perf_counter()
+            try:
+                result = solver.solve(A, order, v0=v0, maxiter=maxiter, tol=tol, ncv=ncv)
+                step.update(status="converged", converged=order, wall_time=time.perf_counter() - tic,
+                            iterations=result.iterations)
+                steps.append(step)
+                debugPrint(f"EigenRetryLadder - rung {rung} {step}", -1)
+                if diagnostics is not None:
+                    diagnostics["eigensolver"] = result.report()
+                return result
+
+            except ArpackNoConvergence as e:
+                error = e
+                if e.eigenvectors is not None and e.eigenvectors.shape[1] > ritz_vectors.shape[1]:
+                    ritz_vectors = e.eigenvectors
+                step.update(status="not converged", converged=int(e.eigenvectors.shape[1]) if e.eigenvectors is not None else 0)
+            except Exception as e:
+                error = e
+                step.update(status="failed", converged=0, error=str(e))
+
+            step["wall_time"] = time.perf_counter() - tic
+            steps.append(step)
+            debugPrint(f"EigenRetryLadder - rung {rung} {step}", -1)
+
+        # Last rung, refine the kept Ritz vectors (padded with random vectors) with LOBPCG
+        check_deadline(len(steps), LobpcgSolver.name)
+        order = min(order, n - 1, max(self.max_vectors(n) // 3, 0))
+        if order < 1:
+            raise error
+
+        X = np.random.default_rng(0).standard_normal((n, order))
+        kept = min(order, ritz_vectors.shape[1])
+        X[:, :kept] = ritz_vectors[:, :kept]
+
+        step = {"rung": len(steps), "backend": LobpcgSolver.name, "order": order, "ncv": None,
+                "tol": EIGEN_RETRY_TOL * EIGEN_TOL_RELAXATION**self.retries, "maxiter": EIGEN_RETRY_MAXITER,
+                "memory": 8 * n * 3 * order, "seeded": kept}
+        tic = time.perf_counter()
+        try:
+            result = LobpcgSolver().refine(A, X, maxiter=step["maxiter"], tol=step["tol"])
+        except Exception as e:
+            step.update(status="failed", converged=0, error=str(e), wall_time=time.perf_counter() - tic)
+            steps.append(step)
+            debugPrint(f"EigenRetryLadder - rung {step['rung']} {step}", -1)
+            raise error if error is not None else e
+
+        # LOBPCG hands back its last iterate whether it converged or not, count the pairs that did
+        scale = max(float(abs(A).sum(axis=1).max()), 1e-300)
+        residuals = np.linalg.norm(A @ result.eigenvectors - result.eigenvectors * result.eigenvalues, axis=0) / scale
+        converged = int(np.sum(residuals <= EIGEN_ACCEPT_TOL))
+        step.update(converged=converged, wall_time=time.perf_counter() - tic, iterations=result.iterations,
+                    residual=float(residuals.max()))
+        if converged < order:
+            step["status"] = "not converged"
+            steps.append(step)
+            debugPrint(f"EigenRetryLadder - rung {step['rung']} {step}", -1)
+            raise ArpackNoConvergence(f"Eigensolver ladder exhausted, {converged} of {order} eigenpairs converged",
+                                      result.eigenvalues[residuals <= EIGEN_ACCEPT_TOL],
+                                      result.eigenvectors[:, residuals <= EIGEN_ACCEPT_TOL])
+
+        step["status"] = "refined"
+        steps.append(step)
+        debugPrint(f"EigenRetryLadder - rung {step['rung']} {step}", -1)
+        if diagnostics is not None:
+            diagnostics["eigensolver"] = result.report()
+        return result
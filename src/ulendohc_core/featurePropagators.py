@@ -0,0 +1,116 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+
+# Relative asymmetry below which the reduced operator is treated as symmetric.
+# The Galerkin projection of the (almost symmetric) conduction operator leaves
+# round-off and boundary term residue of this order.
+SYMMETRY_TOLERANCE = 1e-4
+
+
+class FeaturePropagators():
+    """
+    Compact replacement for the per-feature list of dense r x r propagators.
+
+    Every feature propagates the reduced state with the same shared operator raised
+    to the number of time steps the laser spends on that feature. The operator is
+    diagonalized once per layer, A = W diag(mu) W^-1, so the power for a feature is
+    the diagonal scaling mu**Nt in the eigenbasis. Scalings are memoized per distinct
+    step count since most hatches of a stripe pattern share their length.
+
+    Args:
+        operator (ndarray):
+            The shared r x r operator of the reduced model
+        steps (ndarray):
+            Number of time steps (Nt) spent on each feature
+
+    The operator is diagonalized in double precision, the eigenpairs are stored in the
+    precision of the operator. The powers are taken on the double precision eigenvalues
+    and only the scalings are cast, so mu**Nt does not pick up the round-off of mu.
+    """
+
+    def __init__(self, operator=np.array([]), steps=np.array([])):
+        operator = np.asarray(operator)
+        dtype = operator.dtype if np.issubdtype(operator.dtype, np.floating) else np.float64
+        operator = operator.astype(np.float64)
+        self.steps = np.asarray(steps, dtype=int)
+        self.order = operator.shape[0]
+        self.__scalings = {}
+
+        asymmetry = np.abs(operator - operator.T).max() if self.order else 0
+        if asymmetry <= SYMMETRY_TOLERANCE * max(np.abs(operator).max(), 1):
+            # Orthonormal eigenbasis, the inverse is the transpose
+            self.eigenvalues, self.basis = np.linalg.eigh((operator + operator.T) / 2)
+            self.basis_inv = self.basis.T
+        else:
+            self.eigenvalues, self.basis = np.linalg.eig(operator)
+            self.basis_inv = np.linalg.inv(self.basis)
+
+        self.is_complex = np.iscomplexobj(self.basis)
+        self.__eigenvalues_double = self.eigenvalues
+        if dtype != np.float64:
+            # Single precision eigenpairs, the complex pairs of an asymmetric operator stay complex
+            complex_dtype = np.result_type(dtype, np.complex64)
+            self.eigenvalues = self.eigenvalues.astype(complex_dtype if np.iscomplexobj(self.eigenvalues) else dtype)
+            self.basis = self.basis.astype(complex_dtype if self.is_complex else dtype)
+            self.basis_inv = self.basis_inv.astype(self.basis.dtype)
+        debugPrint(f"FeaturePropagators - order {self.order} complex {self.is_complex} asymmetry {asymmetry}", 0)
+
+    def __len__(self):
+        return self.steps.shape[0]
+
+    def scaling(self, nt:int):
+        """
+        Return the eigenvalues raised to nt, memoized per distinct step count
+        """
+        nt = int(nt)
+        if nt not in self.__scalings:
+            self.__scalings[nt] = np.power(self.__eigenvalues_double, nt).astype(self.eigenvalues.dtype, copy=False)
+        return self.__scalings[nt]
+
+    def feature_scaling(self, feature:int):
+        return self.scaling(self.steps[feature])
+
+    def scaling_table(self):
+        """
+        Return the F x r table of per-feature scalings in the eigenbasis
+        """
+        unique_steps, inverse = np.unique(self.steps, return_inverse=True)
+        if unique_steps.size == 0:
+            return np.zeros((0, self.order), dtype=self.eigenvalues.dtype)
+        return np.stack([self.scaling(nt) for nt in unique_steps])[inverse]
+
+    def to_modal(self, state):
+        """
+        Express a reduced state (or a block of states) in the eigenbasis
+        """
+        return np.dot(self.basis_inv, state)
+
+    def from_modal(self, modal):
+        """
+        Map eigenbasis coordinates back to the reduced state
+        """
+        state = np.dot(self.basis, modal)
+        return state.real if self.is_complex else state
+
+    def project_left(self, row):
+        """
+        Express a row vector acting on reduced states as a row acting on eigenbasis coordinates
+        """
+        return np.dot(row, self.basis)
+
+    def apply(self, feature:int, state):
+        """
+        Propagate a reduced state (or a block of states) through a feature
+        """
+        modal = self.to_modal(state)
+        modal = self.feature_scaling(feature)[:, np.newaxis] * modal if modal.ndim > 1 else self.feature_scaling(feature) * modal
+        return self.from_modal(modal)
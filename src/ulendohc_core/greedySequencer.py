@@ -0,0 +1,509 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+import sys
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# The incremental cost vector is recomputed from scratch every this many selections
+# so round-off from the running updates can not accumulate
+COST_REFRESH_INTERVAL = 64
+
+# Number of features contracted per BLAS call when building the cost terms
+COST_CHUNK_FEATURES = 4096
+
+# Under a deadline the selection checks the clock every this many features
+DEADLINE_CHECK_INTERVAL = 256
+
+# Candidates kept in the pool of the pruned selection
+GREEDY_POOL_SIZE = 64
+
+# Without the bound check the pool is rebuilt from the full cost every this many selections
+GREEDY_POOL_REFRESH_INTERVAL = 16
+
+# Number of features propagated per block product of the R metric post-pass
+R_METRIC_CHUNK_FEATURES = 1024
+
+
+def cost_terms(Beq, propagators, chunk:int = COST_CHUNK_FEATURES):
+    """
+    Compute the static and state dependent cost terms of every feature.
+
+    lambda_0[f] = Beq_f' Cb Beq_f and lambda_1[f] = 2 Beq_f' Cb Final_A**Nt_f, with
+    Cb = I - 1/r the centering matrix of the reduced state. Cb is applied by subtracting
+    the column means, lambda_1 is expressed against eigenbasis coordinates so the
+    propagator is the per-feature scaling. Works on chunks of features so the memory
+    stays O(F * r) and every chunk is a single BLAS product.
+
+    Args:
+        Beq (ndarray):
+            Heat input of every feature in the reduced basis (r x F)
+        propagators (FeaturePropagators):
+            Propagators of the layer
+
+    Returns:
+        tuple:
+            lambda_0 (F,) and lambda_1 (F x r)
+    """
+    order, total_features = Beq.shape
+    lambda_0 = np.empty(total_features, dtype=Beq.dtype)
+    lambda_1 = np.empty((total_features, order), dtype=np.result_type(Beq, propagators.basis))
+    scaling = propagators.scaling_table()
+
+    for start in range(0, total_features, chunk):
+        features = slice(start, min(start + chunk, total_features))
+        Beq_chunk = Beq[:, features]
+        centered = Beq_chunk - Beq_chunk.mean(axis=0)
+
+        lambda_0[features] = np.einsum('ij,ij->j', Beq_chunk, centered)
+        lambda_1[features] = 2 * propagators.project_left(centered.T) * scaling[features]
+
+    return lambda_0, lambda_1
+
+
+def _greedy_select_kernel(lambda_0, lambda_1, scaling, Beq_modal, forced, set_opt, remaining, Z_opt, start, stop,
+                          pool_size, exact, refresh_interval, pool, counters, bounds, Z_ref, costs, norms):
+    """
+    Loop form of the selection phase, compiled with numba when it is available.
+    Evaluates the cost, picks the cheapest remaining feature (or forced[i] when it is set)
+    and advances the optimized state. Runs the steps start to stop in place on the output
+    arrays and the state, so the selection can be resumed in chunks. With pool_size > 0 only the candidate pool is
+    evaluated between refreshes, see GreedySequencer.
+
+    The pool state is kept in the arrays passed in and carried over to the next chunk: the pool,
+    counters = [pool count, step of the last refresh, refreshes], bounds = [outside cost, outside norm],
+    the state at the last refresh Z_ref, the costs at the last refresh and the row norms of lambda_1.
+    """
+    total_features, order = lambda_1.shape
+
+    # Candidate pool and the bound on the cost of the features outside of it
+    pool_count = counters[0]
+    refreshed_at = counters[1]
+    refreshes = counters[2]
+    outside_cost = bounds[0]
+    outside_norm = bounds[1]
+
+    for i in range(start, stop):
+        best = forced[i]
+        if best < 0 and pool_count > 0:
+            best_cost = np.inf
+            for p in range(pool_count):
+                f = pool[p]
+                if remaining[f]:
+                    c = 0.0
+                    for k in range(order):
+                        c += (lambda_1[f, k] * Z_opt[k]).real
+                    c += lambda_0[f]
+                    if c < best_cost or best < 0:
+                        best_cost = c
+                        best = f
+            if best >= 0 and exact:
+                drift = 0.0
+                for k in range(order):
+                    drift += abs(Z_opt[k] - Z_ref[k]) ** 2
+                drift = np.sqrt(drift)
+                if best_cost > outside_cost - outside_norm * drift:
+                    # Bound of every feature outside of the pool, O(F) against the O(F r) of a rescan
+                    for f in range(total_features):
+                        if remaining[f] and costs[f] - norms[f] * drift < best_cost:
+                            best = -1
+                            break
+            elif best >= 0 and i - refreshed_at >= refresh_interval:
+                best = -1
+
+        if best < 0:
+            best_cost = np.inf
+            for f in range(total_features):
+                costs[f] = np.inf
+                if remaining[f]:
+                    c = 0.0
+                    for k in range(order):
+                        c += (lambda_1[f, k] * Z_opt[k]).real
+                    c += lambda_0[f]
+                    costs[f] = c
+                    if c < best_cost or best < 0:
+                        best_cost = c
+                        best = f
+
+            if pool_size > 0:
+                # Keep the features below the pool_size-th smallest cost, that cost bounds the others
+                left = total_features - i
+                outside_cost = np.partition(costs, pool_size)[pool_size] if left > pool_size else np.inf
+                pool_count = 0
+                outside_norm = 0.0
+                for f in range(total_features):
+                    if costs[f] < outside_cost:
+                        pool[pool_count] = f
+                        pool_count += 1
+                        costs[f] = np.inf
+                    elif remaining[f]:
+                        outside_norm = max(outside_norm, norms[f])
+                Z_ref[:] = Z_opt
+                refreshed_at = i
+                refreshes += 1
+
+        set_opt[i] = best
+        remaining[best] = False
+
+        for k in range(order):
+            Z_opt[k] = scaling[best, k] * Z_opt[k] + Beq_modal[k, best]
+
+    counters[0] = pool_count
+    counters[1] = refreshed_at
+    counters[2] = refreshes
+    bounds[0] = outside_cost
+    bounds[1] = outside_norm
+
+
+if NUMBA_AVAILABLE:
+    from numba.core import caching, config
+
+    class FrozenCacheLocator(caching._CacheLocator):
+        """
+        numba cache locator for the PyInstaller bundle, where the .py source of the kernel is not
+        shipped. The compiled kernel is kept in NUMBA_CACHE_DIR and is stamped with the executable,
+        so a new build recompiles once and later processes load it from disk.
+        """
+
+        def __init__(self, py_func, py_file):
+            self._lineno = py_func.__code__.co_firstlineno
+            self._cache_path = os.path.join(config.CACHE_DIR, self.get_suitable_cache_subpath(py_file))
+
+        def get_cache_path(self):
+            return self._cache_path
+
+        def get_source_stamp(self):
+            st = os.stat(sys.executable)
+            return st.st_mtime, st.st_size
+
+        def get_disambiguator(self):
+            return str(self._lineno)
+
+        @classmethod
+        def from_function(cls, py_func, py_file):
+            if not getattr(sys, 'frozen', False) or not config.CACHE_DIR:
+                return None
+            self = cls(py_func, py_file)
+            try:
+                self.ensure_cache_path()
+            except OSError:
+                return None
+            return self
+
+    _cache_impl = getattr(caching, "CacheImpl", None) or caching._CacheImpl
+    if FrozenCacheLocator not in _cache_impl._locator_classes:
+        _cache_impl._locator_classes.insert(0, FrozenCacheLocator)
+
+    # Compiled once and kept in NUMBA_CACHE_DIR so later runs skip the compile
+    try:
+        _greedy_select_compiled = njit(cache=True)(_greedy_select_kernel)
+    except RuntimeError as e:
+        # No writable cache directory, the dispatcher compiles once on the first call of every process
+        debugPrint(f"greedySequencer - numba cache unavailable, the greedy kernel compiles in every process : {e}", -1)
+        _greedy_select_compiled = njit(cache=False)(_greedy_select_kernel)
+else:
+    _greedy_select_compiled = None
+
+
+class GreedySequencer():
+    """
+    Greedy selection of the SmartScan sequence.
+
+    Every step picks the remaining feature with the lowest cost
+    c = lambda_0 + lambda_1 . z, where z is the reduced state in the eigenbasis of the
+    propagators, then advances the state through that feature. The cost vector is
+    updated from the change of the state, the remaining features are tracked with a
+    boolean mask and the output sequence is preallocated.
+
+    With pool_size set, only a pool of candidates is evaluated. The pool is rebuilt from the
+    full cost at state z_r and holds the pool_size cheapest features. A feature f outside of it
+    costs at least c_f(z_r) - |lambda_1[f]| |z - z_r|. With pool_exact the winner of the pool is
+    accepted only below that bound (first checked with the cheapest cost and the largest norm
+    outside of the pool), otherwise the pool is rebuilt, so the sequence is the one of the full
+    scan. Without it the pool is rebuilt every GREEDY_POOL_REFRESH_INTERVAL selections and the
+    sequence is approximate.
+
+    The selection only advances the state the ordering needs, the R metric of the optimized
+    and of the original sequence is evaluated afterwards by r_metrics.
+
+    Args:
+        lambda_0 (ndarray):
+            Static cost of every feature (F)
+        lambda_1 (ndarray):
+            State dependent cost rows of every feature (F x r)
+        Beq_modal (ndarray):
+            Heat input of every feature in the eigenbasis (r x F)
+        propagators (FeaturePropagators):
+            Propagators of the layer, provide the per-feature scalings
+        initial_state (ndarray):
+            Reduced state before the first feature
+        T_m (float):
+            Melting temperature used to normalize the R metric
+        use_numba (bool):
+            Run the compiled selection kernel when numba is installed
+        pool_size (int):
+            Number of candidates evaluated between refreshes, None for the full scan
+        pool_exact (bool):
+            Check the bound on the features outside of the pool
+    """
+
+    def __init__(self, lambda_0, lambda_1, Beq_modal, propagators, initial_state, T_m:float = 1700, use_numba:bool = True,
+                 pool_size=None, pool_exact:bool = True):
+        self.lambda_0 = np.asarray(lambda_0)
+        self.lambda_1 = np.asarray(lambda_1)
+        self.Beq_modal = np.asarray(Beq_modal)
+        self.propagators = propagators
+        self.scaling = propagators.scaling_table()
+        self.initial_state = propagators.to_modal(initial_state)
+        self.T_m = T_m
+        self.total_features = self.lambda_0.shape[0]
+        self.use_numba = use_numba and NUMBA_AVAILABLE
+        self.pool_size = int(pool_size) if pool_size else 0
+        self.pool_exact = pool_exact
+        self.stopped_at = None
+        # Number of times the candidate pool was rebuilt from the full cost during the last run
+        self.refreshes = 0
+
+    def cost(self, state):
+        return self.lambda_0 + np.dot(self.lambda_1, state).real
+
+    def advance(self, feature:int, state):
+        """
+        Propagate an eigenbasis state through a feature and add its heat input
+        """
+        return self.scaling[feature] * state + self.Beq_modal[:, feature]
+
+    def r_metrics(self, sequences, stride:int = 1, chunk:int = R_METRIC_CHUNK_FEATURES):
+        """
+        R metric of one or more sequences, evaluated after the selection
+
+        The sequences are propagated together as the columns of one eigenbasis state. The states
+        after every stride-th feature (counted back from the last one) are collected per chunk of
+        features and mapped back with a single product per chunk.
+
+        Args:
+            sequences (ndarray):
+                One sequence (F,) or a block of sequences (m x F)
+            stride (int):
+                Record the R metric after every stride-th feature
+
+        Returns:
+            tuple:
+                The positions in the sequence the metric was recorded at and the R metric of
+                every sequence at those positions (m x positions)
+        """
+        sequences = np.atleast_2d(np.asarray(sequences, dtype=int))
+        count, total_features = sequences.shape
+        positions = np.arange(total_features - 1, -1, -max(int(stride), 1))[::-1]
+        R = np.empty((count, positions.shape[0]))
+
+        Z = np.repeat(self.initial_state[:, np.newaxis], count, axis=1)
+        recorded = 0
+        for start in range(0, total_features, chunk):
+            stop = min(start + chunk, total_features)
+            samples = positions[(positions >= start) & (positions < stop)]
+            states = np.empty((Z.shape[0], count, samples.shape[0]), dtype=np.result_type(Z, self.scaling, self.Beq_modal))
+            sample = 0
+            for i in range(start, stop):
+                features = sequences[:, i]
+                Z = self.scaling[features].T * Z + self.Beq_modal[:, features]
+                if sample < samples.shape[0] and samples[sample] == i:
+                    states[:, :, sample] = Z
+                    sample += 1
+            T = self.propagators.from_modal(states.reshape(Z.shape[0], -1))
+            R[:, recorded:recorded + sample] = np.std(T, axis=0).reshape(count, sample) / self.T_m
+            recorded += sample
+
+        return positions, R
+
+    def fallback_order(self, remaining):
+        """
+        Remaining features by increasing static cost, appended when the selection runs out of time
+        """
+        features = np.flatnonzero(remaining)
+        return features[np.argsort(self.lambda_0[features], kind='stable')]
+
+    def _refresh_pool(self, state, remaining):
+        """
+        Rebuild the candidate pool from the full cost, returns the cheapest feature
+        """
+        c = np.where(remaining, self.cost(state), np.inf)
+        left = int(remaining.sum())
+        best = int(np.argmin(c))
+        self._outside_cost = np.partition(c, self.pool_size)[self.pool_size] if left > self.pool_size else np.inf
+        inside = c < self._outside_cost
+        self._pool = np.flatnonzero(inside)
+        outside = remaining & ~inside
+        self._outside_norm = self._norms[outside].max() if outside.any() else 0.0
+        c[inside] = np.inf
+        self._outside_costs = c
+        self._pool_state = state.copy()
+        self._refreshed_at = left
+        self.refreshes += 1
+        return best
+
+    def _pool_select(self, state, remaining):
+        """
+        Cheapest feature of the candidate pool, the pool is rebuilt when its winner is not
+        guaranteed (pool_exact) or when it is older than GREEDY_POOL_REFRESH_INTERVAL
+        """
+        pool = self._pool[remaining[self._pool]]
+        if pool.shape[0] == 0:
+            return self._refresh_pool(state, remaining)
+
+        c = self.lambda_0[pool] + np.dot(self.lambda_1[pool], state).real
+        best = int(np.argmin(c))
+        if self.pool_exact:
+            drift = np.linalg.norm(state - self._pool_state)
+            if c[best] > self._outside_cost - self._outside_norm * drift:
+                # Bound of every feature outside of the pool, O(F) against the O(F r) of a rescan
+                if c[best] > np.min(np.where(remaining, self._outside_costs - self._norms * drift, np.inf)):
+                    return self._refresh_pool(state, remaining)
+        elif self._refreshed_at - remaining.sum() >= GREEDY_POOL_REFRESH_INTERVAL:
+            return self._refresh_pool(state, remaining)
+        return int(pool[best])
+
+    def run(self, deadline=None):
+        """
+        Run the greedy selection
+
+        Args:
+            deadline (float):
+                Optional time.time() value, the features left at the deadline are appended by
+                fallback_order and stopped_at records where the selection stopped
+
+        Returns:
+            ndarray:
+                The optimized sequence (F,)
+        """
+        self.stopped_at = None
+        self.refreshes = 0
+        if self.use_numba:
+            return self.run_compiled(deadline)
+
+        set_opt = np.empty(self.total_features, dtype=int)
+        remaining = np.ones(self.total_features, dtype=bool)
+
+        Z_opt = self.initial_state.copy()
+        c = None if self.pool_size else self.cost(Z_opt)
+        forced = None
+        self._pool = np.zeros(0, dtype=int)
+        self._norms = np.linalg.norm(self.lambda_1, axis=1) if self.pool_size else None
+
+        for i in range(self.total_features):
+            if forced is None and deadline is not None and i % DEADLINE_CHECK_INTERVAL == 0 and time.time() >= deadline:
+                self.stopped_at = i
+                forced = self.fallback_order(remaining)
+
+            if forced is not None:
+                I = int(forced[i - self.stopped_at])
+            elif self.pool_size:
+                I = self._pool_select(Z_opt, remaining)
+            else:
+                I = int(np.argmin(np.where(remaining, c, np.inf)))
+            set_opt[i] = I
+            remaining[I] = False
+
+            Z_next = self.advance(I, Z_opt)
+            if forced is None and not self.pool_size:
+                if (i + 1) % COST_REFRESH_INTERVAL == 0:
+                    c = self.cost(Z_next)
+                else:
+                    c += np.dot(self.lambda_1, Z_next - Z_opt).real
+            Z_opt = Z_next
+
+        return set_opt
+
+    def run_compiled(self, deadline=None):
+        """
+        Run the selection phase in the numba compiled kernel, in chunks of
+        DEADLINE_CHECK_INTERVAL features when there is a deadline
+        """
+        self.stopped_at = None
+        self.refreshes = 0
+        total_features = self.total_features
+        dtype = np.result_type(self.lambda_1, self.scaling, self.Beq_modal, self.initial_state)
+        arrays = (np.ascontiguousarray(self.lambda_0, dtype=np.float64),
+                  np.ascontiguousarray(self.lambda_1, dtype=dtype),
+                  np.ascontiguousarray(self.scaling, dtype=dtype),
+                  np.ascontiguousarray(self.Beq_modal, dtype=dtype))
+
+        forced = np.full(total_features, -1, dtype=np.int64)
+        set_opt = np.empty(total_features, dtype=np.int64)
+        remaining = np.ones(total_features, dtype=np.bool_)
+        Z_opt = np.array(self.initial_state, dtype=dtype)
+
+        # Pool state of the kernel, built once and carried across the deadline chunks
+        pool = np.empty(max(self.pool_size, 1), dtype=np.int64)
+        counters = np.zeros(3, dtype=np.int64)
+        bounds = np.array([np.inf, 0.0])
+        Z_ref = Z_opt.copy()
+        costs = np.full(total_features, np.inf)
+        norms = np.linalg.norm(arrays[1], axis=1).astype(np.float64) if self.pool_size else np.zeros(total_features)
+
+        step = total_features if deadline is None else DEADLINE_CHECK_INTERVAL
+        i = 0
+        while i < total_features:
+            if deadline is not None and time.time() >= deadline:
+                self.stopped_at = i
+                forced[i:] = self.fallback_order(remaining)
+                step = total_features
+            stop = min(i + step, total_features)
+            _greedy_select_compiled(*arrays, forced, set_opt, remaining, Z_opt, i, stop, self.pool_size, self.pool_exact,
+                                    GREEDY_POOL_REFRESH_INTERVAL, pool, counters, bounds, Z_ref, costs, norms)
+            i = stop
+
+        self.refreshes = int(counters[2])
+
+        return set_opt.astype(int)
+
+
+def benchmark_greedy_pruning(lambda_0, lambda_1, Beq_modal, propagators, initial_state, T_m:float = 1700,
+                             pool_size:int = GREEDY_POOL_SIZE, use_numba:bool = True):
+    """
+    Run the greedy selection of one layer with the full scan and with both pruning modes
+
+    Args:
+        lambda_0, lambda_1, Beq_modal, propagators, initial_state, T_m:
+            Same as GreedySequencer
+        pool_size (int):
+            Candidates kept in the pool of the pruned runs
+
+    Returns:
+        dict:
+            Per mode the wall time, the speedup over the full scan, the number of pool refreshes,
+            the mean R of the optimized sequence, its change relative to the full scan and the
+            fraction of the positions where the sequence matches the full scan
+    """
+    results = {}
+    sequences = {}
+    for mode in (None, "exact", "approximate"):
+        sequencer = GreedySequencer(lambda_0, lambda_1, Beq_modal, propagators, initial_state, T_m, use_numba=use_numba,
+                                    pool_size=pool_size if mode else None, pool_exact=mode == "exact")
+        tic = time.perf_counter()
+        set_opt = sequencer.run()
+        toc = time.perf_counter()
+        _, R_opt = sequencer.r_metrics(set_opt)
+        sequences[mode or "full"] = set_opt
+        results[mode or "full"] = {"wall_time": toc - tic, "refreshes": sequencer.refreshes, "R_opt": float(np.mean(R_opt))}
+
+    full = results["full"]
+    for mode, result in results.items():
+        result["speedup"] = full["wall_time"] / max(result["wall_time"], 1e-12)
+        result["R_opt_change"] = result["R_opt"] / full["R_opt"] - 1 if full["R_opt"] else 0.0
+        result["matches"] = float(np.mean(sequences[mode] == sequences["full"]))
+        debugPrint(f"benchmark_greedy_pruning - {mode} {result['wall_time']:0.4f} seconds speedup {result['speedup']:0.2f} "
+                   f"R_opt change {result['R_opt_change']:0.3e} matches {result['matches']:0.4f}", -1)
+    return results
@@ -0,0 +1,174 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+
+# Upper bound on the number of grid values evaluated at once (steps x N_x x N_y).
+# Keeps the peak memory of a feature independent of the hatch length.
+KERNEL_CHUNK_ELEMENTS = 2**22
+
+# Spacing of the kernel grid and exponential decay of the laser spot
+KERNEL_GRID_SPACING = 0.2
+KERNEL_DECAY = 2.0
+
+# Heat input values below this fraction of the feature's peak are dropped from the sparse input matrix
+KERNEL_TRUNCATION = 1e-12
+
+# Under a deadline the input matrix checks the clock every this many features
+KERNEL_DEADLINE_INTERVAL = 32
+
+
+class HeatInputKernel():
+    """
+    Accumulated heat input of a hatch on the voxel grid.
+
+    Every time step the laser spot deposits a normalized exp(-2 * distance) distribution
+    on the grid, the input of a feature is the sum over all of its time steps. The grid
+    coordinates are shared by every feature of the layer and the steps are evaluated in
+    chunks so only O(N_x * N_y) values are alive at any time.
+
+    Args:
+        N_x (int):
+            Number of voxels on the x-axis
+        N_y (int):
+            Number of voxels on the y-axis
+        samples_per_cell (float):
+            Optional quadrature resolution in samples per voxel, the distance the spot covers in
+            one time step. Below 1 the hatches are integrated with fewer evenly weighted samples
+            than time steps, at 1 or more every time step keeps its own sample
+        dtype:
+            Floating point type of the assembled input matrix. The kernel itself is always
+            accumulated in double precision, exp(-2 * distance) underflows in single precision
+            once the spot is about 50 grid units away from every grid point
+    """
+
+    def __init__(self, N_x:int, N_y:int, samples_per_cell=None, dtype=np.float64):
+        self.N_x = N_x
+        self.N_y = N_y
+        self.samples_per_cell = samples_per_cell
+        self.dtype = dtype
+
+        self.grid_x = np.arange(N_x) * KERNEL_GRID_SPACING
+        self.grid_y = np.arange(N_y) * KERNEL_GRID_SPACING
+        self.chunk_steps = max(1, KERNEL_CHUNK_ELEMENTS // max(N_x * N_y, 1))
+        # Samples evaluated by the last input_matrix and the feature it stopped at, None when complete
+        self.samples = 0
+        self.stopped_at = None
+
+    def sample_path(self, startPoint, endPoint, steps:int):
+        """
+        Return the spot positions along a hatch and the weight of every position
+        """
+        steps = int(steps)
+        if steps <= 0:
+            return np.zeros(0), np.zeros(0), 1
+
+        if self.samples_per_cell:
+            # Hatch lengths are in voxels like the step counts
+            length = np.sqrt(np.sum(np.power(endPoint - startPoint, 2)))
+            samples = max(int(np.ceil(length * self.samples_per_cell)), 1)
+            if samples < steps:
+                # Midpoint rule over the hatch, every sample stands in for steps / samples time steps
+                t = (np.arange(samples) + 0.5) / samples
+                positions_x = startPoint[0] + t * (endPoint[0] - startPoint[0])
+                positions_y = startPoint[1] + t * (endPoint[1] - startPoint[1])
+                return positions_x.astype(np.float64), positions_y.astype(np.float64), steps / samples
+
+        positions_x = np.linspace(startPoint[0], endPoint[0], steps)
+        positions_y = np.linspace(startPoint[1], endPoint[1], steps)
+        return positions_x.astype(np.float64), positions_y.astype(np.float64), 1
+
+    def feature_input(self, startPoint, endPoint, steps:int):
+        """
+        Accumulate the normalized heat input of a hatch
+
+        Args:
+            startPoint (ndarray):
+                x, y coordinate where the hatch starts
+            endPoint (ndarray):
+                x, y coordinate where the hatch ends
+            steps (int):
+                Number of time steps the laser spends on the hatch
+
+        Returns:
+            numpy.ndarray:
+                N_x x N_y grid of the heat input accumulated over the hatch, in double precision
+        """
+        B = np.zeros((self.N_x, self.N_y))
+        positions_x, positions_y, weight = self.sample_path(startPoint, endPoint, steps)
+        self.samples += positions_x.shape[0]
+
+        for start in range(0, positions_x.shape[0], self.chunk_steps):
+            chunk_x = positions_x[start:start + self.chunk_steps]
+            chunk_y = positions_y[start:start + self.chunk_steps]
+
+            # Squared distances are separable, only their sum needs the full chunk x N_x x N_y buffer
+            distances_x = np.square(self.grid_x[np.newaxis, :] - chunk_x[:, np.newaxis])
+            distances_y = np.square(self.grid_y[np.newaxis, :] - chunk_y[:, np.newaxis])
+
+            Q = distances_x[:, :, np.newaxis] + distances_y[:, np.newaxis, :]
+            np.sqrt(Q, out=Q)
+            np.multiply(Q, -KERNEL_DECAY, out=Q)
+            np.exp(Q, out=Q)
+
+            # Every time step deposits a unit of normalized heat input
+            totals = Q.sum(axis=(1, 2))
+            if not np.all(totals > 0):
+                raise ValueError(f"Hatch {startPoint} -> {endPoint} is out of reach of the {self.N_x} x {self.N_y} kernel grid")
+            norms = weight / totals
+            B += np.tensordot(norms, Q, axes=1)
+
+        return B
+
+    def input_matrix(self, startPoints, endPoints, steps, voxels, deadline=None):
+        """
+        Assemble the heat input of every feature at the given voxels in one pass
+
+        Args:
+            startPoints (ndarray):
+                F x 2 coordinates where the hatches start
+            endPoints (ndarray):
+                F x 2 coordinates where the hatches end
+            steps (ndarray):
+                Number of time steps spent on each hatch
+            voxels (ndarray):
+                Flattened N_x * N_y indices of the voxels that receive heat input
+            deadline (float):
+                Optional time.time() value, past it the assembly stops and stopped_at records
+                the feature it stopped at
+
+        Returns:
+            scipy.sparse.csc_matrix:
+                len(voxels) x F matrix, column f holds the input of feature f, None when the
+                deadline passed first
+        """
+        voxels = np.asarray(voxels, dtype=int)
+        total_features = len(steps)
+        indices = []
+        indptr = np.zeros(total_features + 1, dtype=np.int64)
+        data = []
+        self.samples = 0
+        self.stopped_at = None
+
+        for feature in range(total_features):
+            if deadline is not None and feature % KERNEL_DEADLINE_INTERVAL == 0 and time.time() >= deadline:
+                self.stopped_at = feature
+                return None
+            values = self.feature_input(startPoints[feature], endPoints[feature], steps[feature]).ravel()[voxels]
+            rows = np.flatnonzero(values > KERNEL_TRUNCATION * values.max()) if values.size else np.zeros(0, dtype=int)
+
+            indices.append(rows)
+            # Truncated in double precision, only the kept values are cast
+            data.append(values[rows].astype(self.dtype))
+            indptr[feature + 1] = indptr[feature] + rows.shape[0]
+
+        indices = np.concatenate(indices) if total_features else np.zeros(0, dtype=int)
+        data = np.concatenate(data) if total_features else np.zeros(0, dtype=self.dtype)
+        return sparse.csc_matrix((data, indices, indptr), shape=(voxels.shape[0], total_features))
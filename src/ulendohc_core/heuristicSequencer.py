@@ -0,0 +1,151 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+
+# The max-min spread is quadratic in the number of features, larger layers use the checkerboard
+HEURISTIC_SPREAD_MAX_FEATURES = 4000
+
+# Average number of features per checkerboard cell
+HEURISTIC_FEATURES_PER_CELL = 4
+
+# Colours of the 2 x 2 checkerboard in the order they are visited, diagonal cells first
+CHECKERBOARD_COLOURS = (0, 3, 1, 2)
+
+HEURISTIC_METHODS = ("spread", "checkerboard")
+
+
+def hatch_midpoints(hatch_lines):
+    """
+    Midpoints of the hatches
+
+    Args:
+        hatch_lines (ndarray):
+            Hatch rows [x1, y1, x2, y2, id]
+
+    Returns:
+        numpy.ndarray:
+            F x 2 midpoints
+    """
+    hatch_lines = np.asarray(hatch_lines, dtype=np.float64)
+    return (hatch_lines[:, 0:2] + hatch_lines[:, 2:4]) / 2
+
+
+def max_min_spread(hatch_lines, start:int = 0):
+    """
+    Farthest point order of the hatches
+
+    Every step scans the hatch whose midpoint is farthest from all hatches scanned so far, the
+    heat is spread over the layer instead of building up locally. The distances to the scanned
+    set are kept in one vector that is updated with the newest hatch, O(F) per step.
+
+    Args:
+        hatch_lines (ndarray):
+            Hatch rows [x1, y1, x2, y2, id]
+        start (int):
+            Row scanned first
+
+    Returns:
+        numpy.ndarray:
+            Row order
+    """
+    points = hatch_midpoints(hatch_lines)
+    total_features = points.shape[0]
+    order = np.empty(total_features, dtype=int)
+    if total_features == 0:
+        return order
+
+    distance = np.full(total_features, np.inf)
+    current = start
+    for i in range(total_features):
+        order[i] = current
+        distance = np.minimum(distance, np.sum((points - points[current]) ** 2, axis=1))
+        distance[current] = -1
+        current = int(np.argmax(distance))
+    return order
+
+
+def checkerboard_order(hatch_lines, features_per_cell:int = HEURISTIC_FEATURES_PER_CELL):
+    """
+    Checkerboard interleave of the hatches
+
+    The extent of the layer is cut into square cells holding about features_per_cell hatches
+    each. The cells are coloured like a 2 x 2 checkerboard. Every pass takes the next hatch of
+    each cell, colour by colour, so consecutive hatches never share or neighbour a cell.
+
+    Args:
+        hatch_lines (ndarray):
+            Hatch rows [x1, y1, x2, y2, id]
+        features_per_cell (int):
+            Average number of hatches per cell
+
+    Returns:
+        numpy.ndarray:
+            Row order
+    """
+    points = hatch_midpoints(hatch_lines)
+    total_features = points.shape[0]
+    if total_features == 0:
+        return np.empty(0, dtype=int)
+
+    low = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - low, 1e-9)
+    cell = max(np.sqrt(extent[0] * extent[1] * features_per_cell / total_features), extent.max() / total_features, 1e-9)
+    cells = np.floor((points - low) / cell).astype(int)
+
+    colour_rank = np.argsort(CHECKERBOARD_COLOURS)
+    colour = colour_rank[(cells[:, 0] % 2) * 2 + cells[:, 1] % 2]
+
+    # Rank of every hatch within its cell, in the original order
+    by_cell = np.lexsort((np.arange(total_features), cells[:, 0], cells[:, 1]))
+    sorted_cells = cells[by_cell]
+    first = np.r_[True, np.any(sorted_cells[1:] != sorted_cells[:-1], axis=1)]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(total_features), 0))
+    rank = np.empty(total_features, dtype=int)
+    rank[by_cell] = np.arange(total_features) - group_start
+
+    # Pass (rank) first, then the colour, then the cells row by row
+    return np.lexsort((cells[:, 0], cells[:, 1], colour, rank))
+
+
+def heuristic_order(hatch_lines, method:str = "spread"):
+    """
+    Row order of an eigen-free heuristic
+
+    Args:
+        hatch_lines (ndarray):
+            Hatch rows [x1, y1, x2, y2, id]
+        method (str):
+            "spread" or "checkerboard", large layers always use the checkerboard
+
+    Returns:
+        numpy.ndarray:
+            Row order
+    """
+    if method not in HEURISTIC_METHODS:
+        raise ValueError(f"Unknown heuristic {method}, expected one of {HEURISTIC_METHODS}")
+
+    tic = time.perf_counter()
+    if method == "spread" and np.shape(hatch_lines)[0] <= HEURISTIC_SPREAD_MAX_FEATURES:
+        order = max_min_spread(hatch_lines)
+    else:
+        order = checkerboard_order(hatch_lines)
+    toc = time.perf_counter()
+    debugPrint(f"heuristic_order - {method} {order.shape[0]} features {toc - tic:0.4f} seconds", 0)
+    return order
+
+
+def heuristic_sequence(hatch_lines, method:str = "spread"):
+    """
+    Hatch ids of a layer in the order of the heuristic, the same form as the original
+    sequence hatch_lines[:, -1]
+    """
+    hatch_lines = np.asarray(hatch_lines)
+    return hatch_lines[heuristic_order(hatch_lines, method), -1].astype(int)
@@ -11,7 +11,15 @@
 
 from src.ulendohc_core.util import *
 import src.ulendohc_core.stateMatrixConstruction as SMC
-from numba import jit
+from src.ulendohc_core.featurePropagators import FeaturePropagators
+from src.ulendohc_core.heatInputKernel import HeatInputKernel
+from src.ulendohc_core.greedySequencer import GreedySequencer, cost_terms, GREEDY_POOL_SIZE
+from src.ulendohc_core.eigenSolvers import (EigenRetryLadder, EigenSolverResult, WarmStartSolver, CosineModeSolver,
+                                            EIGEN_MEMORY_BUDGET, DCT_FILL_THRESHOLD, DCT_OVERSAMPLE)
+from src.ulendohc_core.stateCache import default_state_cache, state_key
+from src.ulendohc_core.snapshotBasis import representative_inputs, snapshot_pod_basis
+from src.ulendohc_core.heuristicSequencer import heuristic_order
+from src.ulendohc_core.timeBudget import TimeBudget, BUDGET_KERNEL_FRACTION, BUDGET_ORDER_FRACTION, BUDGET_KERNEL_SAMPLES
 import traceback
 
 class smartscanServer():
@@ -42,7 +50,7 @@ def stack_layers(newLayer=np.array([]), PreviousLayers =np.array([]), n_layers:i
             # Initialize an empty 3D layer when the program is started
             # If the size of the new layer is different from the previous layer then 
             # we need to re-initialize the history so that the code still runs as expected
-            PreviousLayers = np.zeros((newLayer.shape[0], newLayer.shape[1], n_layers))
+            PreviousLayers = np.zeros((newLayer.shape[0], newLayer.shape[1], n_layers), dtype=newLayer.dtype)
         
         debugPrint(f"stackLayers - New Layers Shape {newLayer.shape} Previous Layers Shape {PreviousLayers.shape}", 0)
         # Get the first layer of the newly generated grid, and get N-1 of the grid for the previous layers
@@ -73,7 +81,6 @@ def process_points(hatch_point, coord):
             return x, y, True
     return x, y, False
 
-
 # TODO: Time whether it is faster to convert the hatches or the polygons
 def convert_points_to_voxel(exposure_points = np.array([]), bbox= np.array([]), x_resolution:float = 1, y_resolution:float = 1):
 
@@ -189,31 +196,60 @@ def convert_points_to_voxel(exposure_points = np.array([]), bbox= np.array([]),
     grid = np.dstack((grid, grid_zero))
     return grid
 
+def hatch_bounds(hatch_lines):
+    """
+    Extent of one or more layers of hatches, over the start and the end points
+
+    Args:
+        hatch_lines (ndarray or list):
+            Hatch rows [x1, y1, x2, y2, id] of a layer, or a list of such arrays
+
+    Returns:
+        tuple:
+            x_min, y_min, x_max, y_max
+    """
+    if isinstance(hatch_lines, (list, tuple)):
+        hatch_lines = np.vstack([np.atleast_2d(lines) for lines in hatch_lines])
+    hatch_lines = np.atleast_2d(hatch_lines)
+    x_values = hatch_lines[:, [0, 2]]
+    y_values = hatch_lines[:, [1, 3]]
+    return float(np.min(x_values)), float(np.min(y_values)), float(np.max(x_values)), float(np.max(y_values))
+
 # TODO: Time whether it is faster to convert the hatches or the polygons
-def convert_hatch_to_voxel(hatch_lines, rotation=0, x_resolution=1, y_resolution=1):
+def convert_hatch_to_voxel(hatch_lines, rotation=0, x_resolution=1, y_resolution=1, bounds=None, margin:int = VOXEL_MARGIN):
     """
     Converts hatch lines supplied in bounding box format directly to a voxelized map.
 
+    The grid is cropped to the given bounds (or to the extent of the layer) plus a margin of
+    void voxels, the hatch lines are shifted into that frame in place so the heat input of
+    smartScanCore lines up with the grid.
+
     Args:
         hatch_lines (ndarray): Ordered list of hatches as an ndarray.
         rotation (float): Rotation angle (currently unused in this function).
         x_resolution (float): Width of the slice thickness.
         y_resolution (float): Height of the slice thickness.
+        bounds (tuple): Optional x_min, y_min, x_max, y_max of the frame, pass the bounds of the
+            whole job so the layers of a stack share the same grid.
+        margin (int): Number of void voxels kept around the bounds.
 
     Returns:
-        np.ndarray: A binary grid where 1 represents material presence.
+        tuple: A binary grid where 1 represents material presence, and the x and y offsets that
+            were added to the hatch coordinates.
     """
     # Precompute scaling factors
     x_upscale = 1 / x_resolution
     y_upscale = 1 / y_resolution
 
-    x_min, y_min = np.min(hatch_lines[:, [0, 1]], axis=0)
-    x_max, y_max = np.max(hatch_lines[:, [2, 3]], axis=0)
+    if bounds is None:
+        bounds = hatch_bounds(hatch_lines)
+    x_min, y_min, x_max, y_max = bounds
 
-    x_offset = -x_min if x_min < 0 else 0
-    y_offset = -y_min if y_min < 0 else 0
+    # Crop the grid to the bounds, the origin sits margin voxels below the lowest coordinate
+    x_offset = margin * x_resolution - x_min
+    y_offset = margin * y_resolution - y_min
 
-    # Adjust the bounding box coordinates to ensure positive values
+    # Adjust the bounding box coordinates to the cropped frame
     hatch_lines[:, [0, 2]] += x_offset
     hatch_lines[:, [1, 3]] += y_offset
 
@@ -222,8 +258,8 @@ def convert_hatch_to_voxel(hatch_lines, rotation=0, x_resolution=1, y_resolution
     hatch_lines[:, [1, 3]] *= y_upscale
 
     # Compute grid dimensions
-    grid_x = int(np.ceil((x_max + x_offset) * x_upscale)) + 1
-    grid_y = int(np.ceil((y_max + y_offset) * y_upscale)) + 1
+    grid_x = int(np.ceil((x_max + x_offset) * x_upscale)) + 1 + margin
+    grid_y = int(np.ceil((y_max + y_offset) * y_upscale)) + 1 + margin
     grid = np.zeros((grid_x, grid_y), dtype=np.uint8)
 
     x_coords = np.arange(grid_x)
@@ -254,7 +290,7 @@ def convert_hatch_to_voxel(hatch_lines, rotation=0, x_resolution=1, y_resolution
     grid_zero = np.zeros_like(grid)
     grid = np.dstack((grid, grid_zero))
 
-    return grid, int(np.ceil(x_max) + np.floor(x_min)), int(np.ceil(y_max) + np.floor(y_min))
+    return grid, x_offset, y_offset
 
 # We can take the perimeter of the bounding boxes from the dyndrite software
 # so that we avoid having to re-voxelize an STL file, and the potential errors
@@ -435,9 +471,63 @@ def convert_polygon_to_vector(fragment_data = {}, originalSequenceIDs=[], x_reso
     return grid, np.array(mutlithread_bbox)
 
 
+def adaptive_order_cap(active_nodes:int, min_order:int, max_order:int):
+    """
+    Number of modes solved for a layer in adaptive mode, one per ADAPTIVE_ORDER_NODES_PER_MODE
+    active nodes within [min_order, max_order]
+    """
+    return int(np.clip(active_nodes // ADAPTIVE_ORDER_NODES_PER_MODE, min_order, max_order))
+
+
+def select_modes(Beq, min_order:int, energy:float = ADAPTIVE_ORDER_ENERGY):
+    """
+    Modes of the basis that carry the heat input of the layer
+
+    The energy of a mode is the sum over the features of its squared heat input. The modes are
+    taken by decreasing energy until they hold the requested fraction of the total, at least
+    min_order of them.
+
+    Args:
+        Beq (ndarray):
+            Heat input of every feature in the basis (r x F)
+        min_order (int):
+            Lower bound on the number of modes
+        energy (float):
+            Fraction of the input energy kept
+
+    Returns:
+        tuple:
+            Sorted indices of the kept modes and the fraction of the energy they hold
+    """
+    mode_energy = np.sum(np.abs(Beq) ** 2, axis=1)
+    total = mode_energy.sum()
+    order = Beq.shape[0]
+    if total <= 0:
+        return np.arange(min(min_order, order)), 1.0
+
+    ranked = np.argsort(-mode_energy, kind='stable')
+    captured = np.cumsum(mode_energy[ranked]) / total
+    count = int(np.searchsorted(captured, energy) + 1)
+    count = min(max(count, min_order), order)
+    return np.sort(ranked[:count]), float(captured[count - 1])
+
+
 def smartScanCore (numbers_set=np.array([]), Sorted_layers=np.array([]), dx:float = 1, dy:float = 1, reduced_order:int=20, 
-                    kt:float = 22.5, rho:float = 7990,  cp:float = 500, vs:float = 0.6,  h:float = 50,  P:float = 100, v0_ev=None):
+                    kt:float = 22.5, rho:float = 7990,  cp:float = 500, vs:float = 0.6,  h:float = 50,  P:float = 100, v0_ev=None,
+                    eigen_solver:str = "auto", diagnostics=None, warm_start:bool = True, state_cache=None,
+                    min_order=None, basis_method:str = "eigen", budget=None, greedy_pruning=GREEDY_PRUNING,
+                    r_stride=R_METRIC_STRIDE, precision:str = PRECISION, kernel_samples=None,
+                    eigen_maxiter:int = EIGEN_MAXITER, eigen_retries:int = NUM_RETRIES,
+                    heuristic_method:str = HEURISTIC_METHOD, r_sequences=None):
     try:
+        # Optional dictionary filled with what each stage of the layer did and how long it took
+        diagnostics = {} if diagnostics is None else diagnostics
+        # Stages degrade to stay within the wall-clock budget of the layer, unlimited by default
+        budget = TimeBudget() if budget is None else budget
+        # Floating point type of everything past the system matrix and the eigensolve
+        dtype = PRECISION_DTYPES[precision]
+        diagnostics["precision"] = precision
+
         lambda_val = 0.37
         Rb = 0.075 / 2
 
@@ -452,112 +542,83 @@ def smartScanCore (numbers_set=np.array([]), Sorted_layers=np.array([]), dx:floa
         debugPrint(f"smartScanCore - numbers_set shape: {numbers_set.shape}   Sorted_layers.shape: {Sorted_layers.shape}", -1) 
 
         tic = time.perf_counter()    
-        StateMatrix, F_z, H, G = SMC.constructStateMatrix(N_x, N_y, N_z, dx * 10**-3, dy * 10**-3, h, kt, rho, cp, vs, P)
+        F_x, F_z, H, G = SMC.thermalConstants(dx * 10**-3, dy * 10**-3, h, kt, rho, cp, vs, P)
         G = 1000 * G
         # print("G: ", G)
-        StateMatrix = csr_matrix(StateMatrix, (__ssbounds, __ssbounds))
-        
-        Sorted_layers_T = np.zeros((N_x, N_y, N_z))
-        for k in range(N_z):
-            Sorted_layers_T[:, :, N_z - k - 1] = Sorted_layers[:, :, k]
 
-        Z = diags(np.reshape(Sorted_layers_T, -1), [0], __ssbounds, __ssbounds)           
-        
-        # debugPrint(f"smartScanCore - Generated State Matrix Z:{Z.shape} StateMatrix:{StateMatrix.shape} {__ssbounds} {toc - tic:0.4f} seconds", 0)
+        # The system matrix and its reduced basis only depend on the mask, the grid and the
+        # thermal constants, reruns of a part (or of a material) reuse them from the disk cache
+        state_cache = default_state_cache() if state_cache is None else (state_cache or None)
+        cache_key = state_key(Sorted_layers, dx, dy, F_x, F_z, H) if state_cache else None
+        cached = state_cache.load_matrix(cache_key) if state_cache else None
+        diagnostics["state_cache"] = {"matrix": cached is not None, "basis": False}
 
-        Sorted_layers_T = np.array(Sorted_layers_T)
+        if cached is not None:
+            Final_A, diag = cached
+        else:
+            StateMatrix, _, _, _ = SMC.constructStateMatrix(N_x, N_y, N_z, dx * 10**-3, dy * 10**-3, h, kt, rho, cp, vs, P)
+            StateMatrix = csr_matrix(StateMatrix, (__ssbounds, __ssbounds))
 
-        A1 = Z.dot(StateMatrix)
-        A2 = Z.dot(A1)
-        ones_diag = np.ones((StateMatrix.shape[0], 1))
-        sum_A2 = csr_matrix.sum(A2, axis=1)  
-        
-        A3 = diags(cpy.reshape(ones_diag-sum_A2, -1), [0], __ssbounds, __ssbounds)
-            
-        Correct_A = np.add(A2.tocsr(), A3.tocsr())
-        debugPrint(f"Correct_A: {Correct_A.shape}", 0)
+            Sorted_layers_T = np.zeros((N_x, N_y, N_z))
+            for k in range(N_z):
+                Sorted_layers_T[:, :, N_z - k - 1] = Sorted_layers[:, :, k]
 
-        toc = time.perf_counter()    
-        # debugPrint(f"smartScanCore - Generated State Matrix {toc - tic:0.4f} seconds", -1)  
-        
-        tic = time.perf_counter()
-        Final_A = SMC.addBoundaryConditions(Correct_A, N_x, N_y, N_z, H, 0)    
-        toc = time.perf_counter()    
-        # debugPrint(f"smartScanCore - Added boundary conditions {toc - tic:0.4f} seconds", -1)   
-            
-        diag_elements = Correct_A.diagonal()
-        diag = np.where(diag_elements == 1)
-        #TODO: Reimplement delete of diagonal
-        # Final_A = delete(Correct_A, diag, axis = 0)
-        # Final_A = delete(Final_A, diag, axis = 1)    
-        debugPrint(f"smartScanCore - Final_A: {Final_A.shape}", -1)        
+            Z = diags(np.reshape(Sorted_layers_T, -1), [0], __ssbounds, __ssbounds)           
 
-        tic = time.perf_counter()    
-        retries = 0
-        order = reduced_order
-        
-        while (retries < NUM_RETRIES):
-            try:
-                debugPrint(f"smartScanCore - Reduced order A: {reduced_order}", 0)
-                # Catch a condition where we might try to reduce the order smaller than the existing matrix
-                # Calculating the eigenvalues and eigenvectors            
-                reduced_order = int (order)
-                custom_ncv = min(Final_A.shape[0], int(max(2*reduced_order + 1, __ssbounds/4)))
-                if USE_CUDA == True:
-                    CPY_Final_A = cpy_csr_matrix(Final_A)
-                    temp1, eigen_vectors = eigsh(a=CPY_Final_A, k=reduced_order, which='LA', maxiter=200) 
-                    eigen_vectors = eigen_vectors.get()
-                else:
-                    temp1, eigen_vectors = eigsh(Final_A, reduced_order, which='SA', v0=v0_ev, maxiter=100, return_eigenvectors=True)        
-                    v0_ev = eigen_vectors[:,-10]
-                break
-                
-            except Exception as e:
-                # The eigsh method without CUPY takes a high number of iterations to find a solution
-                # Instead we increase the order to a high number and cap it at the half of the size of geometry        
-                debugPrint(f"smartScanCore - Could not resize to - Final_A: {reduced_order} attempt to use {int (min(50, __ssbounds/2))}", -1) 
-                reduced_order = int (min(50, __ssbounds/2))        
-                
-                custom_ncv = min(Final_A.shape[0], int(max(2*reduced_order + 1, __ssbounds/4)))
-                # We were not able to find any solutions with the previous initialization vector, start at random
-                v0_ev = None 
+            # debugPrint(f"smartScanCore - Generated State Matrix Z:{Z.shape} StateMatrix:{StateMatrix.shape} {__ssbounds} {toc - tic:0.4f} seconds", 0)
 
-                try:
-                    if USE_CUDA == True:
-                        CPY_Final_A = cpy_csr_matrix(Final_A)
-                        temp1, eigen_vectors = eigsh(a=CPY_Final_A, k=reduced_order, which='SA', maxiter=1000) 
-                        eigen_vectors = eigen_vectors.get()
-                    else:
-                        temp1, eigen_vectors = eigsh(Final_A, reduced_order, ncv=custom_ncv, which='SA', v0=v0_ev, maxiter=1000, return_eigenvectors=True)   
-                        v0_ev = eigen_vectors[:,-10]
-                    break
-                    
-                except Exception as e:
-                    retries += 1
-                    order = order / 2 
-                    
-                    if (retries == NUM_RETRIES):
-                        debugPrint(f"smartScanCore - Could not resize to - Final_A: {reduced_order} attempt to use {int (min(50, __ssbounds/2))}", -1) 
-                        raise e                   
-            
-        toc = time.perf_counter()    
-        debugPrint(f"smartScanCore - Order time {toc - tic:0.4f} seconds  eigen_vectors: {eigen_vectors.shape}", -1)     
+            Sorted_layers_T = np.array(Sorted_layers_T)
 
-        # Final_A
-        eigen_vectors = np.array(eigen_vectors)
-        
-        tempAMatrix = np.dot(eigen_vectors.T, Final_A.A)        
-        Final_A = np.dot(tempAMatrix, eigen_vectors)              
+            A1 = Z.dot(StateMatrix)
+            A2 = Z.dot(A1)
+            ones_diag = np.ones((StateMatrix.shape[0], 1))
+            sum_A2 = csr_matrix.sum(A2, axis=1)  
+
+            A3 = diags(cpy.reshape(ones_diag-sum_A2, -1), [0], __ssbounds, __ssbounds)
+
+            Correct_A = np.add(A2.tocsr(), A3.tocsr())
+            debugPrint(f"Correct_A: {Correct_A.shape}", 0)
+
+            toc = time.perf_counter()    
+            # debugPrint(f"smartScanCore - Generated State Matrix {toc - tic:0.4f} seconds", -1)  
 
-        # Create arrays M and N
-        M = np.repeat(np.arange(1, N_x + 1)[:, np.newaxis], N_y, axis=1)  # row information
-        N = np.repeat(np.arange(1, N_y + 1)[np.newaxis, :], N_x, axis=0)  # col information
+            tic = time.perf_counter()
+            Final_A = SMC.addBoundaryConditions(Correct_A, N_x, N_y, N_z, H, 0)    
+            toc = time.perf_counter()    
+            # debugPrint(f"smartScanCore - Added boundary conditions {toc - tic:0.4f} seconds", -1)   
 
-        # Combine M and N along the third dimension
-        MN = np.dstack((M, N))
+            diag_elements = Correct_A.diagonal()
+            diag = np.where(diag_elements == 1)[0]
+
+            if state_cache:
+                state_cache.store_matrix(cache_key, Final_A, diag)
+
+        debugPrint(f"smartScanCore - Final_A: {Final_A.shape}", -1)        
 
-        # Adjust MN values (subtract 1 and multiply by 0.2)
-        MN = (MN - 1) * 0.2 
+        # Void voxels are decoupled rows of Final_A whose eigenvalues sit above the conduction
+        # modes, the basis is solved and projected on the active voxels and ambient nodes only
+        n = Final_A.shape[0]
+        active_nodes = SMC.activeNodes(Sorted_layers)
+
+        # With min_order set, reduced_order is the upper bound of an adaptive order
+        max_order = reduced_order
+        if min_order is not None:
+            min_order = min(min_order, max_order)
+            reduced_order = adaptive_order_cap(active_nodes.shape[0], min_order, max_order)
+        compact = reduced_order + 1 < active_nodes.shape[0] < n
+        Solve_A = Final_A[active_nodes][:, active_nodes] if compact else Final_A
+        diagnostics["compaction"] = {"nodes": n, "active": int(Solve_A.shape[0])}
+        debugPrint(f"smartScanCore - Solving on {Solve_A.shape[0]} of {n} nodes", -1)
+
+        def to_solve_space(X):
+            return X[active_nodes] if compact else X
+
+        def to_full_space(X):
+            if not compact:
+                return X
+            full = np.zeros((n,) + X.shape[1:], dtype=X.dtype)
+            full[active_nodes] = X
+            return full
 
         # Sort the rows of numbers_set based on the fifth column (index 4)
         numbers_set = numbers_set[np.argsort(numbers_set[:, 4])]
@@ -566,186 +627,271 @@ def smartScanCore (numbers_set=np.array([]), Sorted_layers=np.array([]), dx:floa
         feature_n = numbers_set.shape[0]    
         debugPrint(f"smartScanCore - Total features: {feature_n}", 0)
 
-        # Initialize feature_start to 0
-        feature_start = 0
         total_features = int(feature_n)
 
-        # Initialize an empty list for Ab_set
-        Ab_set = dict.fromkeys((range(total_features)))
-
-        # initialize matrices
-        B = np.zeros((MN.shape[0], MN.shape[1]))
-        x, y = [], []
-        Nt = 0
-        
-        # Create a zeros array for Beq
-        Beq = np.zeros((int(Final_A.shape[0]), int(feature_n)))   
- 
-        # debugPrint(f"smartScanCoreCUDA - {Beq.shape} Beq Array Initialized", 2)      
-
         # PRE_COMPUTE
-        MN_SLICE_0 = MN[:, :, 0]
-        MN_SLICE_1 = MN[:, :, 1]
-        q_factor_3 = np.exp(Rb)
-        q_factor_4 = np.exp(np.pi * Rb)
-        q_factor_1 = (2 * lambda_val * P)
-        nt_pre = 1 / vs / (dx * 10**-3 / vs)
-
-        Q = 0
-
-        Ab = np.eye(Final_A.shape[0])    
-
-        tic = time.perf_counter()
+        # The spot kernel is normalized per time step, the grid is shared by every feature
+        coarse_kernel = budget.exceeded(BUDGET_KERNEL_FRACTION) and not (kernel_samples and kernel_samples <= BUDGET_KERNEL_SAMPLES)
+        kernel = HeatInputKernel(N_x, N_y, samples_per_cell=BUDGET_KERNEL_SAMPLES if coarse_kernel else kernel_samples, dtype=dtype)
+        # thermalConstants sets dt = dx / vs, the spot traces one voxel per time step.
+        # The hatch lengths are already in voxels, so they are the step counts without any dx factor
+        nt_pre = 1
+
+        startPoints = numbers_set[:, :2]
+        endPoints = numbers_set[:, 2:4]
+        distances = np.sqrt(np.sum(np.power((endPoints - startPoints), 2), axis=1))
+
+        # Number of time steps spent on each feature, the propagators are built from these
+        feature_steps = np.maximum(np.floor(distances * nt_pre).astype(int), 1)
+
+        # The heat input of feature f at voxel input_voxels[j] drives row j of the basis
+        diag = np.array(diag)
+        input_voxels = diag[diag < N_x*N_y ]
+        debugPrint(f"smartScanCore - input voxels : {input_voxels.shape}", 2)
+
+        # Sparse (input voxels x F) heat input matrix, Beq is a single product with the projected basis
+        B_all = kernel.input_matrix(startPoints, endPoints, feature_steps, input_voxels, deadline=budget.deadline)
+        if coarse_kernel and B_all is not None and kernel.samples < feature_steps.sum():
+            # Only recorded when the coarse quadrature actually dropped samples
+            budget.degrade("heat_input", f"{kernel.samples} of {int(feature_steps.sum())} samples")
+
+        if B_all is None:
+            # Out of time while building the heat input, the features are spread by the heuristic
+            budget.degrade("heat_input", f"stopped at {kernel.stopped_at}/{total_features}, {heuristic_method} heuristic")
+            diagnostics["budget"] = budget.report()
+            diagnostics["sequencer"] = f"heuristic {heuristic_method}"
+            return heuristic_order(numbers_set, heuristic_method), v0_ev, [], []
+        if budget.exceeded():
+            # Out of time before the basis, the features are spread by the heuristic
+            budget.degrade("basis", f"skipped, {heuristic_method} heuristic")
+            diagnostics["budget"] = budget.report()
+            diagnostics["sequencer"] = f"heuristic {heuristic_method}"
+            return heuristic_order(numbers_set, heuristic_method), v0_ev, [], []
+        if budget.exceeded(BUDGET_ORDER_FRACTION) and reduced_order > 2:
+            budget.degrade("basis", f"order {reduced_order} -> {max(reduced_order // 2, 2)}")
+            reduced_order = max(reduced_order // 2, 2)
 
-        for feature_current in range(total_features):
-            numbers = numbers_set[feature_current, :]            
-
-            Ab = np.eye(Final_A.shape[0])
-            Bb = np.zeros((Final_A.shape[0], 1))
-            x, y = [], []
-            Nt = 0
-            B = np.zeros((MN.shape[0], MN.shape[1]))
-            A = Final_A
-            feature_start = feature_start + 1  
-
-            startPoint = numbers[:2]
-            endPoint = numbers[2:4]  
-
-            sqDiff = np.power((endPoint - startPoint), 2)
-            distance = np.sqrt(np.sum(sqDiff))
-
-            nt = distance * nt_pre
-            Nt += int(np.floor(nt))
-
-            # Create linearly spaced arrays for x and y
-            x.extend(np.linspace(startPoint[0], endPoint[0], int(nt)))
-            y.extend(np.linspace(startPoint[1], endPoint[1], int(nt)))        
-            debugPrint(f"smartScanCore - X: {x} Y: {y}", 2)
-
-            # Indices for the last int(nt) steps
-            idx_start = Nt - int(nt)
-
-            positions_x = np.asarray(x[idx_start:Nt])  # shape (steps,)
-            positions_y = np.asarray(y[idx_start:Nt])  # shape (steps,)
-
-            # Make sure MN_SLICE_0 and MN_SLICE_1 are NumPy arrays of shape (M, N)
-            MN0 = np.asarray(MN_SLICE_0)
-            MN1 = np.asarray(MN_SLICE_1)
-
-            distances_all = np.sqrt(
-                (MN0[None, :, :] - positions_x[:, None, None])**2
-                + (MN1[None, :, :] - positions_y[:, None, None])**2
-            )  # shape (steps, M, N)
-
-            # 2) Compute the exponential factor exp(-2*rb) for all steps simultaneously
-            q_factor_2_all = np.exp(-2.0 * distances_all)  # shape (steps, M, N)
-
-            Q_unn = q_factor_1 * (q_factor_2_all / q_factor_3) / q_factor_4  # shape (steps, M, N)
-
-            sum_Q_unn = Q_unn.sum(axis=(1, 2), keepdims=True)   # shape (steps, 1, 1)
-            Q_norm_all = Q_unn / sum_Q_unn                     # shape (steps, M, N)
-
-            B += Q_norm_all.sum(axis=0)  # shape (M, N)
-
-            debugPrint(f"smartScanCore - Current Features: {feature_current}", 2)
-            
-            debugPrint(f"smartScanCore - Ab : {Ab.shape}", 2)
-            
-            debugPrint(f"smartScanCore - Bb : {Bb.shape}", 2)
-
-            Ab = np.power(Ab, Nt)
-
-            Ab_1 = np.matmul(Ab, eigen_vectors.T)            
-            debugPrint(f"smartScanCore - Ab_1 : {Ab_1.shape}", 2)
+        tic = time.perf_counter()    
+        debugPrint(f"smartScanCore - Reduced order A: {reduced_order}", 0)
+        if USE_CUDA == True:
+            CPY_Final_A = cpy_csr_matrix(Solve_A)
+            temp1, eigen_vectors = eigsh(a=CPY_Final_A, k=reduced_order, which='LA', maxiter=200) 
+            eigen_vectors = eigen_vectors.get()
+        else:
+            # The backend is picked from the size and sparsity of Solve_A unless one is requested.
+            # On failure the ladder retries within a memory budget and keeps the converged Ritz vectors.
+            # A requested backend solves every layer, the warm start and the cosine modes only run on "auto"
+            eigen_result = None
+            auto_solver = eigen_solver == "auto"
+            if basis_method == "pod":
+                # Basis from the simulated response to the layer's own heat inputs instead of the eigenpairs
+                try:
+                    eigen_result = snapshot_pod_basis(Solve_A, to_solve_space(representative_inputs(B_all, n)), reduced_order)
+                    diagnostics["eigensolver"] = eigen_result.report()
+                except Exception as e:
+                    debugPrint(f"smartScanCore - Snapshot basis failed, solving for the eigenpairs: {e}", 0)
+
+            use_cache = state_cache and basis_method == "eigen"
+            cached_basis = state_cache.load_basis(cache_key, reduced_order) if use_cache else None
+            if cached_basis is not None:
+                eigen_result = EigenSolverResult(None, to_solve_space(np.array(cached_basis)), "cache", 0, time.perf_counter() - tic)
+                diagnostics["eigensolver"] = eigen_result.report()
+                diagnostics["state_cache"]["basis"] = True
+
+            # Bases and starting vectors are exchanged between layers in the full node space
+            v0_ev = to_solve_space(v0_ev) if v0_ev is not None and np.shape(v0_ev)[0] == n else v0_ev
+
+            if basis_method == "pod":
+                v0_ev = None
+
+            if eigen_result is None and v0_ev is not None and np.ndim(v0_ev) == 2:
+                # Basis of the previous layer, only reusable while the grid shape is unchanged
+                if auto_solver and v0_ev.shape[0] == Solve_A.shape[0]:
+                    try:
+                        eigen_result = WarmStartSolver().solve(Solve_A, reduced_order, v0=v0_ev)
+                        diagnostics["eigensolver"] = eigen_result.report()
+                    except Exception as e:
+                        debugPrint(f"smartScanCore - Could not reuse the previous basis, solving from scratch: {e}", 0)
+                v0_ev = None
+
+            # Fill of the part inside its bounding box, the void margin around the hatches does not count
+            solid = Sorted_layers != 0
+            extent = [np.flatnonzero(solid.any(axis=axes)) for axes in ((1, 2), (0, 2), (0, 1))]
+            box = np.prod([e[-1] - e[0] + 1 for e in extent]) if solid.any() else n
+            if auto_solver and eigen_result is None and np.count_nonzero(solid) >= DCT_FILL_THRESHOLD * box:
+                # Solid blocks and coupons, the cosine modes of the grid only need a short refinement
+                try:
+                    modes = to_solve_space(SMC.cosineModes(N_x, N_y, N_z, F_x, F_z, reduced_order + DCT_OVERSAMPLE))
+                    eigen_result = CosineModeSolver().solve(Solve_A, reduced_order, v0=modes)
+                    diagnostics["eigensolver"] = eigen_result.report()
+                except Exception as e:
+                    debugPrint(f"smartScanCore - Cosine modes did not converge, solving from scratch: {e}", 0)
 
-            B_current = np.reshape(B,  [N_x*N_y, -1])
-            debugPrint(f"smartScanCore - B_current : {B_current.shape}", 2)
+            if eigen_result is None:
+                ladder = EigenRetryLadder(eigen_solver, memory_budget=EIGEN_MEMORY_BUDGET, retries=eigen_retries, maxiter=eigen_maxiter)
+                try:
+                    eigen_result = ladder.solve(Solve_A, reduced_order, v0=v0_ev, diagnostics=diagnostics, deadline=budget.deadline)
+                except Exception:
+                    if not budget.exceeded():
+                        raise
+                    # The ladder ran out of time before a rung converged
+                    budget.degrade("basis", f"eigensolve stopped, {heuristic_method} heuristic")
+                    diagnostics["budget"] = budget.report()
+                    diagnostics["sequencer"] = f"heuristic {heuristic_method}"
+                    return heuristic_order(numbers_set, heuristic_method), v0_ev, [], []
+            eigen_vectors = eigen_result.eigenvectors
+
+            if use_cache and eigen_result.backend != "cache":
+                state_cache.store_basis(cache_key, reduced_order, to_full_space(eigen_vectors))
 
-            diag = np.array(diag)
-            debugPrint(f"smartScanCore - diag : {diag.shape}", 2)
-            
-            B_current = B_current[diag[diag < N_x*N_y ]]
+        toc = time.perf_counter()    
+        debugPrint(f"smartScanCore - Order time {toc - tic:0.4f} seconds  eigen_vectors: {eigen_vectors.shape}", -1)     
 
-            Ab_1 = np.multiply(G, Ab_1)
-            
-            Ab1_temp = np.concatenate((B_current, np.zeros((Ab_1.shape[1] - B_current.shape[0], 1))))
+        # Final_A
+        eigen_vectors = np.array(eigen_vectors)
+        solve_vectors = eigen_vectors
+        eigen_vectors = to_full_space(eigen_vectors)
 
-            Ab_1 = np.dot(Ab_1, Ab1_temp)
-            # print("Ab1_temp: ", Ab1_temp)
-            # print("Ab_1: ", Ab_1)
+        # Hand the whole basis to the next layer when warm starting, otherwise a single starting vector
+        v0_ev = eigen_vectors if warm_start else eigen_vectors[:, -min(10, eigen_vectors.shape[1])]
 
-            Bb = np.add(Bb, Ab_1)
-            
-            Beq[:, feature_current] = Bb[:,0]
-            Ab_set[feature_current] = Ab
-        # print(np.sum(Beq, axis=0))
-        
+        # The basis only ranks the features from here on, it is kept in the precision of the job
+        solve_vectors = solve_vectors.astype(dtype, copy=False)
 
-        # # Initialize Cb matrix    
-        Cb_ones = np.ones((reduced_order, reduced_order))/reduced_order
-        Cb = np.eye(reduced_order) - Cb_ones
-        
-        # Calculate lambda_0
-        lambda_0 = np.diag(np.matmul(Beq.T,  np.matmul(Cb, Beq)))
+        tic = time.perf_counter()
+        Beq = dtype(G) * (B_all.T @ eigen_vectors[:input_voxels.shape[0]].astype(dtype, copy=False)).T
+        debugPrint(f"smartScanCore - B_all : {B_all.shape} nnz {B_all.nnz} Beq : {Beq.shape}", 2)
+
+        if min_order is not None:
+            # Only the modes the features actually drive are kept for the sequencing
+            kept, energy = select_modes(Beq, min_order)
+            Beq, solve_vectors = Beq[kept], solve_vectors[:, kept]
+            diagnostics["reduced_order"] = {"min": int(min_order), "max": int(max_order), "solved": int(reduced_order),
+                                            "selected": int(kept.shape[0]), "energy": energy}
+            debugPrint(f"smartScanCore - Reduced order {kept.shape[0]} of {reduced_order} holding {energy:0.4f} of the input", -1)
+
+        # Galerkin projection V' (A V) with sparse-times-dense products, peak memory stays O(n * r).
+        # The basis vanishes on the void voxels so the compacted product is the full one
+        tempAMatrix = Solve_A.astype(dtype, copy=False) @ solve_vectors
+        Final_A = np.dot(solve_vectors.T, tempAMatrix)
+
+        # Diagonalize the reduced operator once, every feature propagates the state with Final_A**Nt.
+        # The heat input accumulated over the feature (Beq) is added after the propagation
+        propagators = FeaturePropagators(Final_A, feature_steps)
         
-        # if DEBUG_LEVEL > 2:
-        #     np.savetxt("staging/lambda_0.txt", lambda_0)
-
-        # Initialize lambda_1 (empty list)
-        lambda_1 = np.zeros((int(feature_n), Final_A.shape[0]))
 
-        def __calculateLambda_1 (feature):
-            lambda_1[feature] = (2 * np.matmul(Beq[:, feature].T, np.matmul(Cb, Ab_set[feature])))
-        
-        with ThreadPoolExecutor(max_workers=CPU_COUNT) as executor:
-            executor.map(__calculateLambda_1, range(1, int(feature_n)))    
+        # Cost terms of the greedy selection, lambda_1 acts on the state expressed in the eigenbasis of Final_A
+        lambda_0, lambda_1 = cost_terms(Beq, propagators)
 
-        Tm0 = np.concatenate((T_init * np.ones(Final_A.shape[0] - 2), [T_a, T_a]))     
+        Tm0 = np.concatenate((T_init * np.ones(Final_A.shape[0] - 2), [T_a, T_a])).astype(dtype)
 
-        # set_opt contains the smart scan sequence - save the output
-        set_opt = np.array([])
         debugPrint(f"smartScanCore -lambda_0 {lambda_0.shape} lambda_1: {lambda_1.shape} T_opt: {Tm0.shape}", 2)
 
         toc = time.perf_counter()    
         debugPrint(f"smartScanCore - Loop time {toc - tic:0.4f} seconds", 2)
-        
-        # T_opt = np.array(T_opt)
-    
-        R_opt = []
-        R_ori = []
 
         tic = time.perf_counter()
-        
-        T_ori = Tm0.copy()
-        T_opt = Tm0.copy()
-        
-        for i in range(total_features):
-            
-            # OG Solution:
-            c = lambda_0 + np.dot(lambda_1, T_opt)
-            sorted_indices = np.argsort(c)
-            indices = sorted_indices[~np.isin(sorted_indices, set_opt)]
-            I = int(indices[0])
-            
-            T_opt_temp = np.dot(Ab_set[I], T_opt)
-            T_opt = np.add(T_opt_temp, Beq[:, I])
-            
-            T_ori_temp = np.dot(Ab_set[i], T_ori)
-            T_ori = np.add(T_ori_temp, Beq[:, i])
 
-            R_opt.append(np.std(T_opt) / T_m)
-            R_ori.append(np.std(T_ori) / T_m)
-            set_opt = np.append(set_opt, I)
+        # set_opt contains the smart scan sequence - save the output
+        # The sequencer propagates in the eigenbasis, each feature only scales the state by mu**Nt
+        # With pruning only a pool of GREEDY_POOL_SIZE candidates is evaluated between refreshes
+        sequencer = GreedySequencer(lambda_0, lambda_1, propagators.to_modal(Beq), propagators, Tm0, T_m,
+                                    pool_size=GREEDY_POOL_SIZE if greedy_pruning else None,
+                                    pool_exact=greedy_pruning == "exact")
+        set_opt = sequencer.run(deadline=budget.deadline)
+        diagnostics["greedy"] = {"pruning": greedy_pruning, "refreshes": sequencer.refreshes}
+        diagnostics["sequencer"] = "greedy"
+        if sequencer.stopped_at is not None:
+            budget.degrade("sequence", f"greedy stopped at {sequencer.stopped_at}/{total_features}")
 
         toc = time.perf_counter()  
-        # debugPrint(f"R_opt: {R_opt}", -1)
-        # R_opt = np.std(T_opt)
-        # R_ori = np.std(T_ori)
-        # debugPrint(f"R_ori: {R_ori}", -1)  
         debugPrint(f"smartScanCore - End sort time {toc - tic:0.4f} seconds", 2)
 
-        return set_opt.astype(int), v0_ev, R_opt, R_ori
+        # R metric of the optimized and of the original order, propagated together as two columns.
+        # Sequences passed in r_sequences (from another basis) are evaluated in this layer's basis alongside
+        R_opt, R_ori = [], []
+        if r_stride is not None and budget.exceeded():
+            budget.degrade("r_metric", "skipped")
+        elif r_stride is not None:
+            tic = time.perf_counter()
+            sequences = [set_opt, np.arange(total_features)] + ([] if r_sequences is None else list(r_sequences))
+            _, R = sequencer.r_metrics(np.stack(sequences), r_stride)
+            R_opt, R_ori = R[0].tolist(), R[1].tolist()
+            if r_sequences is not None:
+                diagnostics["r_sequences"] = R[2:].tolist()
+            toc = time.perf_counter()
+            debugPrint(f"smartScanCore - R metric time {toc - tic:0.4f} seconds", 2)
+        diagnostics["budget"] = budget.report()
+
+        return set_opt, v0_ev, R_opt, R_ori
     
     except Exception as e:
         print(traceback.format_exc())
-        raise e
\ No newline at end of file
+        raise e
+
+
+def diagnostics_summary(diagnostics, prefix:str = ""):
+    """
+    One line description of the diagnostics of a layer, as written to the output file
+
+    Lists the sequencer that produced the order, the accepted eigensolver with its iterations and
+    time, the rungs of the retry ladder and the reduced order. A layer split into islands lists
+    every island under its own prefix.
+    """
+    entries = []
+    if "sequencer" in diagnostics:
+        entries.append(f"{prefix}sequencer:{diagnostics['sequencer']}")
+    if "eigensolver" in diagnostics:
+        eigen = diagnostics["eigensolver"]
+        entries.append(f"{prefix}eigensolver:{eigen['backend']} {eigen['iterations']}it {eigen['wall_time']:0.3f}s")
+    if "eigensolver_ladder" in diagnostics:
+        rungs = ",".join(f"{step['backend']} {step['status']} {step.get('wall_time', 0):0.3f}s" for step in diagnostics["eigensolver_ladder"])
+        entries.append(f"{prefix}ladder:{rungs}")
+    if "reduced_order" in diagnostics:
+        order = diagnostics["reduced_order"]
+        entries.append(f"{prefix}order:{order['selected']}/{order['solved']}")
+    if "greedy" in diagnostics:
+        entries.append(f"{prefix}greedy:{diagnostics['greedy']['pruning'] or 'full'} {diagnostics['greedy']['refreshes']} refreshes")
+
+    islands = diagnostics.get("islands", {})
+    if islands.get("count", 1) > 1:
+        entries.append(f"{prefix}islands:{islands['count']} {islands['executor']}")
+    for island, island_diagnostics in enumerate(islands.get("solves", [])):
+        entries.append(diagnostics_summary(island_diagnostics, prefix=f"{prefix}island{island}."))
+    return ";".join(entry for entry in entries if entry)
+
+
+def benchmark_precision(corpus, precisions=tuple(PRECISION_DTYPES), **kwargs):
+    """
+    Run smartScanCore on a reference corpus of layers in every precision
+
+    Args:
+        corpus (list):
+            (numbers_set, Sorted_layers) pairs of the reference layers
+        precisions (tuple):
+            Precisions to compare, the first one is the reference
+        **kwargs:
+            Remaining smartScanCore parameters
+
+    Returns:
+        list:
+            Per layer and precision the wall time, the mean R of the optimized sequence and the
+            fraction of the positions where the sequence matches the reference precision
+    """
+    results = []
+    for layer, (numbers_set, Sorted_layers) in enumerate(corpus):
+        layer_results = {}
+        for precision in precisions:
+            tic = time.perf_counter()
+            set_opt, _, R_opt, _ = smartScanCore(numbers_set=numbers_set.copy(), Sorted_layers=Sorted_layers, precision=precision,
+                                                 state_cache=False, **kwargs)
+            toc = time.perf_counter()
+            reference = layer_results.get(precisions[0], {}).get("sequence", set_opt)
+            layer_results[precision] = {"wall_time": toc - tic, "R_opt": float(np.mean(R_opt)) if len(R_opt) else None,
+                                        "sequence": np.asarray(set_opt), "matches": float(np.mean(np.asarray(set_opt) == reference))}
+            debugPrint(f"benchmark_precision - layer {layer} {precision} {toc - tic:0.4f} seconds "
+                       f"matches {layer_results[precision]['matches']:0.4f}", -1)
+        for result in layer_results.values():
+            result.pop("sequence")
+        results.append(layer_results)
+    return results
@@ -0,0 +1,151 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+from src.ulendohc_core.eigenSolvers import EigenSolverResult
+
+from scipy.sparse.linalg import ArpackNoConvergence
+
+# Number of features whose heat input drives the snapshot simulation
+POD_INPUT_FEATURES = 16
+
+# Time steps simulated per input, every step adds one snapshot of each input
+POD_SNAPSHOT_STEPS = 24
+
+# Extra singular vectors kept while the snapshots are compressed
+POD_OVERSAMPLE = 8
+
+# Singular values below this fraction of the largest one do not count towards the rank
+POD_RANK_TOL = 1e-10
+
+BASIS_METHODS = ("eigen", "pod")
+
+
+def representative_inputs(B_all, n_rows:int, count:int = POD_INPUT_FEATURES):
+    """
+    Heat input of count features spread evenly over the id order of the layer
+
+    Args:
+        B_all (sparse matrix):
+            Heat input of every feature (input voxels x F)
+        n_rows (int):
+            Number of nodes of the system matrix
+        count (int):
+            Number of features used
+
+    Returns:
+        numpy.ndarray:
+            n_rows x count block, the input of a feature drives the first rows of the state
+            like it does in Beq
+    """
+    total_features = B_all.shape[1]
+    picks = np.unique(np.linspace(0, total_features - 1, min(count, total_features)).round().astype(int))
+    inputs = np.zeros((n_rows, picks.shape[0]))
+    inputs[:B_all.shape[0]] = B_all[:, picks].toarray()
+    return inputs
+
+
+def snapshot_pod_basis(A, inputs, order:int, steps:int = POD_SNAPSHOT_STEPS, oversample:int = POD_OVERSAMPLE):
+    """
+    Proper orthogonal decomposition of the free response of the system to the given inputs
+
+    The inputs are advanced by steps sparse products with A and every state is a snapshot. The
+    snapshots are compressed into their leading left singular vectors as they are produced, so
+    only n x (order + oversample + inputs) values are alive at any time.
+
+    Args:
+        A (sparse matrix):
+            The system matrix
+        inputs (ndarray):
+            n x p block of heat inputs
+        order (int):
+            Number of basis vectors
+        steps (int):
+            Number of simulated time steps
+
+    Returns:
+        EigenSolverResult:
+            The basis with the singular values of its vectors in place of the eigenvalues
+
+    Raises:
+        ArpackNoConvergence:
+            When the snapshots span fewer than order directions
+    """
+    tic = time.perf_counter()
+    X = np.asarray(inputs, dtype=np.float64)
+    norms = np.linalg.norm(X, axis=0)
+    X = X[:, norms > 0] / norms[norms > 0]
+
+    keep = order + oversample
+    U = np.zeros((A.shape[0], 0))
+    sigma = np.zeros(0)
+    for _ in range(steps + 1):
+        U, sigma, _ = np.linalg.svd(np.hstack((U * sigma, X)), full_matrices=False)
+        U, sigma = U[:, :keep], sigma[:keep]
+        X = A @ X
+    toc = time.perf_counter()
+
+    rank = int(np.sum(sigma > POD_RANK_TOL * sigma[0])) if sigma.shape[0] else 0
+    debugPrint(f"snapshot_pod_basis - rank {rank} of {order} from {inputs.shape[1]} inputs, {toc - tic:0.4f} seconds", -1)
+    if rank < order:
+        raise ArpackNoConvergence(f"Snapshots span {rank} of {order} directions", sigma, U)
+    return EigenSolverResult(sigma[:order], U[:, :order], "pod", steps, toc - tic)
+
+
+def benchmark_basis_methods(numbers_set, Sorted_layers, methods=BASIS_METHODS, **kwargs):
+    """
+    Run smartScanCore on one layer with every basis method
+
+    The R metric depends on the basis it is evaluated in, so every sequence is evaluated in the
+    basis of the first (reference) method. The other methods run first and the reference run
+    evaluates their sequences together with its own.
+
+    Args:
+        numbers_set (ndarray):
+            Hatch rows [x1, y1, x2, y2, id] of the layer in voxel coordinates
+        Sorted_layers (ndarray):
+            N_x x N_y x N_z voxel mask, the newest layer first
+        methods (tuple):
+            Basis methods to compare, the first one is the reference
+        **kwargs:
+            Remaining smartScanCore parameters
+
+    Returns:
+        dict:
+            Per method the wall time of the layer, of the basis, the mean R of the optimized and of
+            the original sequence in the reference basis (None when the reference run skipped the R
+            metric) and the fraction of the positions where the sequence matches the reference one
+    """
+    from src.ulendohc_core.smartScanCore import smartScanCore
+
+    kwargs["r_stride"] = kwargs.get("r_stride") or R_METRIC_STRIDE or 1
+    reference, others = methods[0], list(methods[1:])
+    results, sequences = {method: {} for method in methods}, {}
+    for method in others + [reference]:
+        diagnostics = {}
+        tic = time.perf_counter()
+        r_sequences = [sequences[other] for other in others] if method == reference and others else None
+        set_opt, _, R_opt, R_ori = smartScanCore(numbers_set=numbers_set.copy(), Sorted_layers=Sorted_layers, basis_method=method,
+                                                 diagnostics=diagnostics, state_cache=False, r_sequences=r_sequences, **kwargs)
+        toc = time.perf_counter()
+        sequences[method] = np.asarray(set_opt)
+        results[method].update(wall_time=toc - tic, basis=diagnostics.get("eigensolver", {}))
+
+    R_others = diagnostics.get("r_sequences")
+    for index, method in enumerate(methods):
+        if not len(R_opt) or (method != reference and R_others is None):
+            R_method = None
+        else:
+            R_method = float(np.mean(R_opt if method == reference else R_others[index - 1]))
+        results[method].update(R_opt=R_method, R_ori=float(np.mean(R_ori)) if len(R_ori) else None,
+                               matches=float(np.mean(sequences[method] == sequences[reference])))
+        debugPrint(f"benchmark_basis_methods - {method} {results[method]['wall_time']:0.4f} seconds R_opt {R_method} "
+                   f"matches {results[method]['matches']:0.4f}", -1)
+    return results
@@ -0,0 +1,220 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+
+import hashlib
+import shutil
+import tempfile
+
+# Bump when the layout or the content of an entry changes, older entries then miss and age out
+STATE_CACHE_VERSION = 2
+
+_MATRIX_FILES = ("data", "indices", "indptr")
+
+
+def state_key(Sorted_layers, dx:float, dy:float, F_x:float, F_z:float, H:float):
+    """
+    Content address of a layer's system matrix
+
+    The matrix only depends on the voxel mask, the grid and the conduction and convection
+    terms, the input term G scales the heat input and is not part of the key.
+
+    Args:
+        Sorted_layers (ndarray):
+            N_x x N_y x N_z voxel mask of the stacked layers
+        dx (float):
+            Voxel size on the x-axis
+        dy (float):
+            Voxel size on the y-axis
+        F_x, F_z, H (float):
+            Fourier numbers and convection term from thermalConstants
+
+    Returns:
+        str:
+            Hex digest identifying the entry
+    """
+    mask = np.asarray(Sorted_layers) != 0
+    digest = hashlib.sha256()
+    digest.update(f"v{STATE_CACHE_VERSION}|{mask.shape}|{dx!r}|{dy!r}|{F_x!r}|{F_z!r}|{H!r}".encode())
+    digest.update(np.packbits(mask).tobytes())
+    return digest.hexdigest()
+
+
+class StateCache():
+    """
+    On-disk cache of the boundary conditioned system matrix and of its reduced bases.
+
+    Every key is a directory holding the CSR arrays of Final_A, the input voxels and one
+    eigenvector block per reduced order as plain .npy files, which are loaded memory mapped so
+    a hit costs a few file opens. Entries are written to a temporary name and renamed into
+    place, concurrent workers never see a partial entry. Hits refresh the modification time of
+    the entry, the least recently used entries are evicted once the cache exceeds size_cap.
+    The size is scanned once and then kept as a running total of the stores, the directory is
+    only rescanned when that total crosses size_cap.
+
+    Args:
+        directory (str):
+            Root of the cache
+        size_cap (int):
+            Upper bound on the size of the cache in bytes
+    """
+
+    def __init__(self, directory:str = STATE_CACHE_DIR, size_cap:int = STATE_CACHE_SIZE_CAP):
+        self.directory = directory
+        self.size_cap = size_cap
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = self.size()
+
+    def entry_path(self, key:str):
+        return os.path.join(self.directory, key)
+
+    def _touch(self, key:str):
+        try:
+            os.utime(self.entry_path(key))
+        except OSError:
+            pass
+
+    def _load(self, key:str, name:str):
+        return np.load(os.path.join(self.entry_path(key), name + ".npy"), mmap_mode='r')
+
+    def load_matrix(self, key:str):
+        """
+        Return (Final_A, input voxels) of an entry, or None on a miss
+        """
+        try:
+            data, indices, indptr, shape, input_voxels = [self._load(key, name) for name in _MATRIX_FILES + ("shape", "input_voxels")]
+        except (OSError, ValueError):
+            return None
+
+        self._touch(key)
+        Final_A = csr_matrix((data, indices, indptr), shape=tuple(int(n) for n in shape))
+        debugPrint(f"StateCache - matrix hit {key[:12]} {Final_A.shape}", 0)
+        return Final_A, np.asarray(input_voxels)
+
+    def store_matrix(self, key:str, Final_A, input_voxels):
+        """
+        Write the system matrix and its input voxels as a new entry
+        """
+        if os.path.isdir(self.entry_path(key)):
+            return
+        Final_A = csr_matrix(Final_A)
+        arrays = {"data": Final_A.data, "indices": Final_A.indices, "indptr": Final_A.indptr,
+                  "shape": np.array(Final_A.shape), "input_voxels": np.asarray(input_voxels)}
+        staging = None
+        try:
+            staging = tempfile.mkdtemp(prefix=".staging_", dir=self.directory)
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, name + ".npy"), array)
+            stored = sum(entry.stat().st_size for entry in os.scandir(staging))
+            os.rename(staging, self.entry_path(key))
+        except OSError as e:
+            # Another worker stored the same key first, or the disk is not writable
+            debugPrint(f"StateCache - could not store {key[:12]}: {e}", 0)
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+            return
+        self._grow(stored)
+
+    def load_basis(self, key:str, order:int):
+        """
+        Return the eigenvector block of the given order, or None on a miss
+        """
+        try:
+            basis = self._load(key, f"basis_{int(order)}")
+        except (OSError, ValueError):
+            return None
+        self._touch(key)
+        debugPrint(f"StateCache - basis hit {key[:12]} {basis.shape}", 0)
+        return basis
+
+    def store_basis(self, key:str, order:int, eigenvectors):
+        """
+        Add the eigenvector block of the given order to an existing entry
+        """
+        if not os.path.isdir(self.entry_path(key)):
+            return
+        target = os.path.join(self.entry_path(key), f"basis_{int(order)}.npy")
+        try:
+            replaced = os.path.getsize(target) if os.path.exists(target) else 0
+            handle, staging = tempfile.mkstemp(prefix=".staging_", suffix=".npy", dir=self.entry_path(key))
+            with os.fdopen(handle, "wb") as f:
+                np.save(f, np.ascontiguousarray(eigenvectors))
+            stored = os.path.getsize(staging)
+            os.replace(staging, target)
+        except OSError as e:
+            debugPrint(f"StateCache - could not store the basis of {key[:12]}: {e}", 0)
+            return
+        self._grow(stored - replaced)
+
+    def entries(self):
+        """
+        Return (modification time, size, key) of every entry
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self.entry_path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, key))
+            except OSError:
+                continue
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def _grow(self, nbytes:int):
+        self._size += nbytes
+        if self._size > self.size_cap:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in size_cap
+
+        Rescans the directory, so entries stored by other workers are accounted for, and
+        resets the running size to what is left.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.size_cap:
+                break
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            total -= size
+            debugPrint(f"StateCache - evicted {key[:12]} ({size} bytes)", 0)
+        self._size = total
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+        self._size = 0
+
+
+_default_cache = None
+
+
+def default_state_cache():
+    """
+    Cache at STATE_CACHE_DIR, or None when the cache is disabled or the directory is not writable
+    """
+    global _default_cache
+    if not ENABLE_STATE_CACHE:
+        return None
+    if _default_cache is None:
+        try:
+            _default_cache = StateCache()
+        except OSError as e:
+            debugPrint(f"StateCache - disabled, {STATE_CACHE_DIR} is not writable: {e}", 0)
+            return None
+    return _default_cache
@@ -10,6 +10,8 @@
 
 from src.ulendohc_core.util import *
 
+from scipy.fft import idct
+
 # Chuan He
 # Generate the state matrix, A, without boundary conditions considered
 # Inputs: L - length
@@ -27,18 +29,29 @@ from src.ulendohc_core.util import *
 # Number of elements on the x-axis
 # Number of elements on the y-axis
 # Number of elements on the z-axis (Must be one more than one layer)
-def constructStateMatrix(N_x, N_y, N_z, dx, dz, h, kt, rho, cp, vs, P):
+def thermalConstants(dx, dz, h, kt, rho, cp, vs, P):
+    """
+    Fourier numbers, convection and input terms of the state matrix
+
+    Returns:
+        tuple:
+            F_x, F_z, H, G
+    """
     alpha = kt / rho / cp  # Diffusivity [m^2/s]
     dt = dx / vs / 1 # Sampling time [s] (Assume laser spot is tracing one grid per time step)
 
-    # Assuming you have defined the necessary variables (replace with your actual values)
     F_x = alpha * dt / dx / dx
     F_z = alpha * dt / dz / dz
     H = alpha * h * dt / kt / dz
+    G = alpha * P * dt / kt / dx / dx / dx
+    return F_x, F_z, H, G
+
+
+def constructStateMatrix(N_x, N_y, N_z, dx, dz, h, kt, rho, cp, vs, P):
+    F_x, F_z, H, G = thermalConstants(dx, dz, h, kt, rho, cp, vs, P)
     
     __stmbounds = N_x * N_y * N_z
     A = lil_matrix((__stmbounds, __stmbounds)) # Initialize sparse matrix
-    G = alpha * P * dt / kt / dx / dx / dx
 
     # Corners.
     A[0, 0] = 1 - 2 * F_x - F_z
@@ -314,8 +327,73 @@ def addBoundaryConditions(Correct_A, N_x, N_y, N_z, H, F):
     # Final_A[num_elements, num_elements] = 1
     # Final_A[num_elements + 1, num_elements + 1] = 1
     
-    # return csr_matrix(Final_A)
-    return Final_A
+    # CSR keeps the eigensolver mat-vecs and the projection sparse
+    return csr_matrix(Final_A)
+
+
+def activeNodes(Sorted_layers):
+    """
+    Nodes of Final_A that take part in conduction. The rows of void voxels (Z = 0) are
+    decoupled identity rows (1 - H on the diagonal in the convection layer), only the active
+    voxels and the two ambient nodes at N_x * N_y and N_x * N_y + 1 couple to the part.
+
+    Args:
+        Sorted_layers (ndarray):
+            N_x x N_y x N_z voxel mask of the stacked layers
+
+    Returns:
+        numpy.ndarray:
+            Sorted flat indices of the active voxels and the ambient nodes
+    """
+    N_x, N_y, N_z = Sorted_layers.shape
+    # Same layer order as the Z mask of smartScanCore
+    mask = np.reshape(Sorted_layers[:, :, ::-1], -1) != 0
+    ambient = np.arange(N_x * N_y, min(N_x * N_y + 2, mask.shape[0]))
+    return np.union1d(np.flatnonzero(mask), ambient)
+
+
+def cosineModes(N_x, N_y, N_z, F_x, F_z, m):
+    """
+    Analytic eigenvectors of the state matrix of a filled N_x x N_y x N_z grid. Without voids
+    the conduction part is F_x (L_x + L_y) + F_z L_z, a Kronecker sum of 1-D Neumann
+    Laplacians, whose eigenvectors are products of DCT-II modes with eigenvalues
+    2 - 2 cos(pi p / N) per axis. The solvers target the smallest algebraic eigenvalues of
+    I - F L, so the m modes with the largest Laplacian eigenvalues are returned, followed by the
+    unit vectors of the two ambient nodes.
+
+    Args:
+        N_x, N_y, N_z (int):
+            Grid size
+        F_x, F_z (float):
+            Fourier numbers from thermalConstants
+        m (int):
+            Number of cosine modes
+
+    Returns:
+        numpy.ndarray:
+            n x (m + 2) block in the node order of constructStateMatrix (x fastest, then y, then z)
+    """
+    n = N_x * N_y * N_z
+    m = min(m, n)
+
+    axes = []
+    for N, F in ((N_x, F_x), (N_y, F_x), (N_z, F_z)):
+        # Column p of the inverse orthonormal DCT of the identity is the p-th DCT-II mode
+        modes = idct(np.eye(N), type=2, norm='ortho', axis=0)
+        eigenvalues = F * (2 - 2 * np.cos(np.pi * np.arange(N) / N))
+        keep = np.argsort(-eigenvalues)[:m]
+        axes.append((modes[:, keep], eigenvalues[keep]))
+    (C_x, mu_x), (C_y, mu_y), (C_z, mu_z) = axes
+
+    mu = mu_x[:, None, None] + mu_y[None, :, None] + mu_z[None, None, :]
+    selected = np.argsort(-mu, axis=None, kind='stable')[:m]
+    p, q, s = np.unravel_index(selected, mu.shape)
+    X = np.einsum('zk,yk,xk->zyxk', C_z[:, s], C_y[:, q], C_x[:, p]).reshape(n, -1)
+
+    ambient = np.zeros((n, 2))
+    for j, node in enumerate(range(N_x * N_y, min(N_x * N_y + 2, n))):
+        ambient[node, j] = 1
+    return np.hstack((X, ambient))
 
 
 def returnOtherParams(vs, rho, cp, h, P, kt, dx, dz):
@@ -0,0 +1,110 @@
+#*******************************************************
+# Copyright (C) 2023-2024 Ulendo Technologies, Inc
+# This file is part of Ulendo HC Plugin.
+# The Ulendo HC Plugin and files contained within the Ulendo HC
+# project folder can not be copied and/or distributed without the
+# express permission of an authorized member of
+# Ulendo Technologies, Inc.
+# For more information contact info@ulendo.io
+#*******************************************************
+
+from src.ulendohc_core.util import *
+
+# Fractions of a layer budget after which smartScanCore degrades a stage: the heat input is
+# integrated with a coarse quadrature, then the reduced order is halved. Past the whole budget
+# the greedy selection stops and the remaining features are appended by their static cost
+BUDGET_KERNEL_FRACTION = 0.3
+BUDGET_ORDER_FRACTION = 0.4
+
+# Quadrature samples per voxel of the coarse heat input kernel, a hatch normally takes one per voxel
+BUDGET_KERNEL_SAMPLES = 0.25
+
+
+class TimeBudget():
+    """
+    Wall-clock budget of a layer or of a job.
+
+    The deadline is an absolute time.time() value, so a budget handed to a worker process
+    still expires at the same moment. Every stage that gives up accuracy to stay within the
+    budget records itself with degrade, the records end up in the output file.
+
+    The heat input checks the deadline between chunks of features, the eigensolver between the
+    rungs of its ladder and the greedy selection between chunks of selections. A rung that is
+    already running is not interrupted, so a layer can overrun its budget by one eigensolve.
+
+    Args:
+        seconds (float):
+            Length of the budget, None for an unlimited budget
+        deadline (float):
+            Absolute deadline, overrides seconds
+    """
+
+    def __init__(self, seconds=None, deadline=None):
+        self.start = time.time()
+        if deadline is None and seconds is not None:
+            deadline = self.start + seconds
+        self.deadline = deadline
+        self.degradations = []
+
+    @property
+    def limited(self):
+        return self.deadline is not None
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def remaining(self):
+        return np.inf if self.deadline is None else max(self.deadline - time.time(), 0.0)
+
+    def exceeded(self, fraction:float = 1):
+        """
+        True once the given fraction of the budget is spent
+        """
+        if self.deadline is None:
+            return False
+        return time.time() >= self.start + fraction * (self.deadline - self.start)
+
+    def split(self, parts:int, cap=None):
+        """
+        Budget of the next of parts equal shares of what is left, at most cap seconds
+        """
+        seconds = self.remaining() / max(parts, 1)
+        if cap is not None:
+            seconds = min(seconds, cap)
+        return TimeBudget(None if np.isinf(seconds) else seconds)
+
+    def share(self):
+        """
+        Budget with the same deadline and its own records, for a concurrent sub-problem
+        """
+        budget = TimeBudget(deadline=self.deadline)
+        budget.start = self.start
+        return budget
+
+    def degrade(self, stage:str, action:str):
+        self.degradations.append({"stage": stage, "action": action, "elapsed": self.elapsed()})
+        debugPrint(f"TimeBudget - {stage}: {action} after {self.elapsed():0.4f} seconds", -1)
+
+    def merge(self, report, label=None):
+        """
+        Add the records of a sub-problem budget
+        """
+        for record in report.get("degradations", []) if report else []:
+            record = dict(record)
+            if label is not None:
+                record["stage"] = f"{label}/{record['stage']}"
+            self.degradations.append(record)
+
+    @property
+    def hit(self):
+        return len(self.degradations) > 0
+
+    def report(self):
+        return {"seconds": None if self.deadline is None else self.deadline - self.start,
+                "elapsed": self.elapsed(), "degradations": list(self.degradations)}
+
+    def summary(self):
+        """
+        One line description of the degradations, as written to the output file
+        """
+        return ";".join(f"{record['stage']}:{record['action']}" for record in self.degradations)
@@ -78,8 +78,128 @@ USE_HATCH_COMPUTE = False
 # Setting this variable to True will set the Smart
 
 NUM_RETRIES = 3
+# Iteration limit of the first rung of the eigensolver retry ladder
+EIGEN_MAXITER = 100
 POINT_RADIUS = 0.5
 
+# Void voxels kept around the extent of the hatches when the voxel grid is cropped
+VOXEL_MARGIN = 1
+
+# Optional tiled mode, islands wider than TILE_SIZE_MM are solved on overlapping tiles of that size,
+# the tiles share TILE_OVERLAP voxels with their neighbours. None keeps every island whole.
+# At most TILE_MAX_WORKERS tile solves run at the same time so the peak memory stays bounded
+TILE_SIZE_MM = None
+TILE_OVERLAP = 8
+TILE_MAX_WORKERS = 2
+
+# Adaptive reduced order, the basis is solved with one mode per ADAPTIVE_ORDER_NODES_PER_MODE
+# active nodes within [REDUCED_ORDER_MIN, REDUCED_ORDER_MAX] and trimmed to the modes holding
+# ADAPTIVE_ORDER_ENERGY of the heat input of the layer
+REDUCED_ORDER_MIN = 8
+REDUCED_ORDER_MAX = 50
+ADAPTIVE_ORDER_NODES_PER_MODE = 20
+ADAPTIVE_ORDER_ENERGY = 0.99
+
+# Wall-clock budgets in seconds, None leaves the layers (or the job) unlimited. A job budget is
+# shared out evenly over the layers that are left, at most LAYER_TIME_BUDGET each
+LAYER_TIME_BUDGET = None
+JOB_TIME_BUDGET = None
+
+# Layers with fewer features than HEURISTIC_FEATURE_THRESHOLD, and layers whose solve fails, are
+# sequenced by the eigen-free HEURISTIC_METHOD ("spread" or "checkerboard"). At 3 every layer the
+# reduced model used to sequence still goes through it
+HEURISTIC_FEATURE_THRESHOLD = 3
+HEURISTIC_METHOD = "spread"
+
+# Candidate pruning of the greedy selection, None scans every feature at every step, "exact"
+# keeps a pool of candidates behind a bound check (same sequence) and "approximate" refreshes
+# the pool periodically without the check
+GREEDY_PRUNING = None
+
+# The R metric of a layer is evaluated after the sequencing, after every R_METRIC_STRIDE-th
+# feature. None skips it, the layers then report empty R lists
+R_METRIC_STRIDE = 1
+
+# Floating point precision of the heat input, the basis past the eigensolve, the projection and
+# the greedy selection. The system matrix and the eigensolves always run in double precision
+PRECISION = "double"
+PRECISION_DTYPES = {"double": np.float64, "single": np.float32}
+
+# Named quality/speed presets of a job. SOLVER_SETTINGS holds every solver knob at its default
+# ("balanced"), the other presets override a consistent subset of them:
+#   resolution       voxel edge in mm (dx = dy), a hatch spends one time step per voxel it crosses
+#   objective_layers number of layers in the history of the thermal model, at least 2
+#   reduced_order_*  bounds of the adaptive reduced order
+#   kernel_samples   heat input quadrature per voxel below 1, None for one sample per time step
+#   eigen_maxiter    iteration limit of the first eigensolver rung, eigen_retries ARPACK retries
+#   tile_size_mm     edge of the tiles of the tiled mode, None to solve every island whole
+#   tile_workers     number of tile solves running at the same time
+SOLVER_SETTINGS = {
+    "resolution": 1,
+    "objective_layers": 2,
+    "reduced_order_min": REDUCED_ORDER_MIN,
+    "reduced_order_max": REDUCED_ORDER_MAX,
+    "kernel_samples": None,
+    "eigen_maxiter": EIGEN_MAXITER,
+    "eigen_retries": NUM_RETRIES,
+    "basis_method": "eigen",
+    "layer_time_budget": LAYER_TIME_BUDGET,
+    "job_time_budget": JOB_TIME_BUDGET,
+    "heuristic_threshold": HEURISTIC_FEATURE_THRESHOLD,
+    "heuristic_method": HEURISTIC_METHOD,
+    "greedy_pruning": GREEDY_PRUNING,
+    "r_stride": R_METRIC_STRIDE,
+    "precision": PRECISION,
+    "tile_size_mm": TILE_SIZE_MM,
+    "tile_workers": TILE_MAX_WORKERS,
+}
+SOLVER_PRESETS = {
+    "draft": {"resolution": 2, "reduced_order_min": 4, "reduced_order_max": 20,
+              "kernel_samples": 0.5, "eigen_maxiter": 50, "eigen_retries": 1, "layer_time_budget": 60,
+              "heuristic_threshold": 50, "greedy_pruning": "approximate", "r_stride": None, "precision": "single"},
+    "balanced": {},
+    "thorough": {"objective_layers": 3, "reduced_order_min": 16, "reduced_order_max": 100,
+                 "eigen_maxiter": 300, "eigen_retries": 5},
+}
+DEFAULT_PRESET = "balanced"
+
+
+def solver_preset(name:str = DEFAULT_PRESET, **overrides):
+    """
+    Solver settings of a named preset
+
+    Args:
+        name (str):
+            One of SOLVER_PRESETS, None for the default preset
+        **overrides:
+            Individual settings that replace the ones of the preset
+
+    Returns:
+        dict:
+            Every key of SOLVER_SETTINGS
+    """
+    name = DEFAULT_PRESET if name is None else name
+    if name not in SOLVER_PRESETS:
+        raise ValueError(f"Unknown preset '{name}', expected one of {list(SOLVER_PRESETS)}")
+    unknown = set(overrides) - set(SOLVER_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown solver settings {sorted(unknown)}, expected some of {list(SOLVER_SETTINGS)}")
+    return {**SOLVER_SETTINGS, **SOLVER_PRESETS[name], **overrides}
+
+# Persistent on-disk cache for the numba compiled kernels, the packaged application
+# can not write the cache next to its sources so it is kept beside the config files
+from src.utils.io_utils import persistent_path
+NUMBA_CACHE_DIR = persistent_path("numba_cache")
+os.environ.setdefault("NUMBA_CACHE_DIR", NUMBA_CACHE_DIR)
+
+# Content addressed cache of system matrices and reduced bases, shared by every job on this machine.
+# The least recently used entries are evicted once the cache grows past STATE_CACHE_SIZE_CAP bytes.
+# Off by default, it writes up to the cap beside the config files (the working directory outside of the
+# packaged application), enable it where repeated jobs on the same parts make that worthwhile
+ENABLE_STATE_CACHE = False
+STATE_CACHE_DIR = persistent_path("state_cache")
+STATE_CACHE_SIZE_CAP = 2 * 2**30
+
 
 def set_debug_levels(debug_level:int=5, file_level:int=0, plot_level:bool=False):
     FILE_LOGGING_LEVEL = file_level
@@ -11,6 +11,7 @@ config_defaults = {
         "output": default_output_dir,
         "license_key": "",
         "feature": 0,
+        "preset": "balanced",
         "active": True
     }
 }
@@ -0,0 +1,68 @@
+import numpy as np
+
+from src.ulendohc_core import smartScanCore as core
+from src.ulendohc_core.domainDecomposition import smartScanIslands
+
+
+def two_islands():
+    rows = []
+    for x0 in (2, 30):
+        for y in np.arange(2, 8, 1.0):
+            rows.append([x0, y, x0 + 6, y, len(rows)])
+    hatches = np.array(rows, dtype=float)
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    return hatches, core.stack_layers(grid, np.array([]), 2)
+
+
+def test_islands_return_the_embedded_basis():
+    hatches, layers = two_islands()
+    v0_ev = np.ones((10, 4))
+    diagnostics = {}
+    # Exact island bases, the cosine modes of the solid islands are only refined to WARM_START_ACCEPT_TOL
+    set_opt, basis, R_opt, R_ori = smartScanIslands(numbers_set=hatches, Sorted_layers=layers, reduced_order=6,
+                                                    v0_ev=v0_ev, diagnostics=diagnostics, max_workers=1,
+                                                    eigen_solver="dense", state_cache=False)
+
+    assert diagnostics["islands"]["count"] == 2
+    assert sorted(set_opt) == list(range(hatches.shape[0]))
+    # The islands are simulated apart, their R is reported per island only
+    assert R_opt == R_ori == []
+    assert [len(R["R_opt"]) for R in diagnostics["islands"]["R"]] == [6, 6]
+
+    # The island bases side by side warm start a solve of the whole layer
+    assert basis.shape == (np.prod(layers.shape), sum(diagnostics["islands"]["orders"]))
+    layer_diagnostics = {}
+    core.smartScanCore(numbers_set=hatches, Sorted_layers=layers, reduced_order=6, v0_ev=basis,
+                       diagnostics=layer_diagnostics, state_cache=False)
+    assert layer_diagnostics["eigensolver"]["backend"] == "warm_start"
+
+
+def test_islands_summary_lists_every_island():
+    hatches, layers = two_islands()
+    diagnostics = {}
+    smartScanIslands(numbers_set=hatches, Sorted_layers=layers, reduced_order=6, diagnostics=diagnostics,
+                     max_workers=1, state_cache=False)
+
+    summary = core.diagnostics_summary(diagnostics)
+    assert "islands:2 serial" in summary
+    assert "island0.sequencer:greedy" in summary
+    assert "island1.sequencer:greedy" in summary
+
+
+def test_tiles_run_within_the_worker_cap():
+    # One island, 60 voxels wide, of short hatches spread over three 20 voxel tiles
+    rows = []
+    for y in np.arange(2, 6, 1.0):
+        for x in range(2, 60, 6):
+            rows.append([x, y, x + 5, y, len(rows)])
+    hatches = np.array(rows, dtype=float)
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    layers = core.stack_layers(grid, np.array([]), 2)
+    diagnostics = {}
+    set_opt, _, _, _ = smartScanIslands(numbers_set=hatches, Sorted_layers=layers, reduced_order=6,
+                                        diagnostics=diagnostics, max_workers=4, tile_size=20, tile_workers=1,
+                                        state_cache=False)
+
+    assert diagnostics["islands"]["count"] > 1
+    assert diagnostics["islands"]["executor"] == "serial"
+    assert sorted(set_opt) == list(range(hatches.shape[0]))
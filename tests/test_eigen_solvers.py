@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.sparse.linalg import ArpackNoConvergence
+
+from src.ulendohc_core import eigenSolvers
+from src.ulendohc_core.eigenSolvers import EigenRetryLadder
+
+
+def laplacian(n=400):
+    return sparse.diags([-np.ones(n - 1), 2 * np.ones(n), -np.ones(n - 1)], [-1, 0, 1], format="csr")
+
+
+def test_ladder_stops_at_the_deadline():
+    # One ARPACK iteration can not converge, the retries are skipped once the deadline passed
+    ladder = EigenRetryLadder("arpack", maxiter=1, retries=2)
+    diagnostics = {}
+    with pytest.raises(TimeoutError):
+        ladder.solve(laplacian(), 6, diagnostics=diagnostics, deadline=time.time() - 1)
+
+    steps = diagnostics["eigensolver_ladder"]
+    assert steps[0]["status"] == "not converged"
+    assert steps[-1]["status"] == "skipped" and steps[-1]["error"] == "deadline"
+    assert len(steps) == 2
+
+
+def test_lobpcg_rung_counts_its_converged_pairs(monkeypatch):
+    diagnostics = {}
+    result = EigenRetryLadder("arpack", maxiter=1, retries=0).solve(laplacian(), 4, diagnostics=diagnostics)
+    step = diagnostics["eigensolver_ladder"][-1]
+    assert step["backend"] == "lobpcg" and step["status"] == "refined" and step["converged"] == 4
+    np.testing.assert_allclose(result.eigenvalues, np.sort(np.linalg.eigvalsh(laplacian().toarray()))[:4], atol=1e-6)
+
+    # Starved of iterations the last rung can not converge, the ladder raises instead of passing it on
+    monkeypatch.setattr(eigenSolvers, "EIGEN_RETRY_MAXITER", 1)
+    diagnostics = {}
+    with pytest.raises(ArpackNoConvergence):
+        EigenRetryLadder("arpack", maxiter=1, retries=0).solve(laplacian(), 4, diagnostics=diagnostics)
+    step = diagnostics["eigensolver_ladder"][-1]
+    assert step["status"] == "not converged" and step["converged"] < 4
+
+
+@pytest.mark.parametrize("backend", sorted(eigenSolvers.EIGEN_SOLVERS))
+def test_backends_return_the_smallest_eigenpairs(backend):
+    n, k = 60, 4
+    A = laplacian(n)
+    result = eigenSolvers.get_eigensolver(backend).solve(A, k)
+
+    # The Dirichlet Laplacian has eigenvalues 2 - 2 cos(pi j / (n + 1)) with sine eigenvectors
+    j = np.arange(1, k + 1)
+    np.testing.assert_allclose(result.eigenvalues, 2 - 2 * np.cos(np.pi * j / (n + 1)), atol=1e-6)
+    modes = np.sin(np.pi * np.outer(np.arange(1, n + 1), j) / (n + 1))
+    modes /= np.linalg.norm(modes, axis=0)
+    np.testing.assert_allclose(np.abs(np.sum(modes * result.eigenvectors, axis=0)), 1, atol=1e-4)
+    assert result.backend == backend
+
+
+def test_warm_start_matches_a_cold_solve():
+    n, k = 200, 6
+    A = laplacian(n)
+    # The basis of a slightly different system, as handed over by the previous layer
+    previous = eigenSolvers.DenseSolver().solve(A + sparse.diags(np.linspace(0, 1e-3, n)), k + 2)
+
+    warm = eigenSolvers.WarmStartSolver().solve(A, k, v0=previous.eigenvectors)
+    cold = eigenSolvers.DenseSolver().solve(A, k)
+    assert warm.backend == "warm_start"
+    np.testing.assert_allclose(warm.eigenvalues, cold.eigenvalues, rtol=1e-4)
+    # Same subspace: the cold eigenvectors lie in the span of the warm ones
+    overlap = np.linalg.svd(warm.eigenvectors.T @ cold.eigenvectors, compute_uv=False)
+    np.testing.assert_allclose(overlap, 1, atol=1e-4)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from src.ulendohc_core.featurePropagators import FeaturePropagators
+
+
+def test_single_precision_powers_in_double():
+    rng = np.random.default_rng(0)
+    basis, _ = np.linalg.qr(rng.standard_normal((6, 6)))
+    operator = basis @ np.diag([0.2, 0.5, 0.9, 0.99, 0.999, 0.9995]) @ basis.T
+    steps = np.array([1, 500, 5000])
+
+    operator = operator.astype(np.float32)
+    double = FeaturePropagators(operator.astype(np.float64), steps)
+    single = FeaturePropagators(operator, steps)
+
+    table = single.scaling_table()
+    assert table.dtype == np.float32
+    # Powering the float32 eigenvalues would amplify their round-off by Nt
+    np.testing.assert_allclose(table, double.scaling_table().astype(np.float32), rtol=1e-6, atol=1e-30)
@@ -0,0 +1,197 @@
+import importlib.util
+import py_compile
+import shutil
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from src.ulendohc_core import greedySequencer
+from src.ulendohc_core.featurePropagators import FeaturePropagators
+
+
+def random_problem(features=40, order=6, seed=0):
+    rng = np.random.default_rng(seed)
+    operator = np.diag(rng.uniform(0.5, 0.95, order))
+    propagators = FeaturePropagators(operator, rng.integers(1, 10, features))
+    Beq_modal = propagators.to_modal(rng.uniform(0, 1, (order, features)))
+    lambda_0, lambda_1 = greedySequencer.cost_terms(rng.uniform(0, 1, (order, features)), propagators)
+    return lambda_0, lambda_1, Beq_modal, propagators, np.zeros(order)
+
+
+def import_bundled(tmp_path, name="greedySequencerBundled"):
+    # PyInstaller bundles ship bytecode only
+    source = tmp_path / f"{name}.py"
+    shutil.copy(greedySequencer.__file__, source)
+    compiled = tmp_path / f"{name}.pyc"
+    py_compile.compile(str(source), cfile=str(compiled), doraise=True)
+    source.unlink()
+
+    spec = importlib.util.spec_from_file_location(name, compiled)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_import_without_source(tmp_path):
+    # Without the source numba can not locate a cache for these functions
+    pytest.importorskip("numba")
+    module = import_bundled(tmp_path)
+
+    assert module._greedy_select_compiled is not None
+    problem = random_problem()
+    compiled = module.GreedySequencer(*problem).run()
+    reference = greedySequencer.GreedySequencer(*problem, use_numba=False).run()
+    np.testing.assert_array_equal(compiled, reference)
+
+
+def test_frozen_bundle_reuses_the_cache(tmp_path, monkeypatch):
+    pytest.importorskip("numba")
+    from numba.core import config
+    executable = tmp_path / "ulendohc_tool"
+    executable.write_bytes(b"bundle")
+    monkeypatch.setattr(sys, "frozen", True, raising=False)
+    monkeypatch.setattr(sys, "executable", str(executable))
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path / "numba_cache"))
+    problem = random_problem()
+
+    first = import_bundled(tmp_path, "greedySequencerFrozen")
+    first.GreedySequencer(*problem).run()
+    assert list((tmp_path / "numba_cache").rglob("*.nbi"))
+
+    # A second process of the same build loads the kernel instead of compiling it
+    second = import_bundled(tmp_path, "greedySequencerFrozen")
+    second.GreedySequencer(*problem).run()
+    assert sum(second._greedy_select_compiled.stats.cache_hits.values()) == 1
+
+
+def test_compiled_chunks_carry_the_pool():
+    pytest.importorskip("numba")
+    lambda_0, lambda_1, Beq_modal, propagators, initial_state = random_problem(features=1000, order=8, seed=1)
+    # A weak state dependence keeps the pool valid over many selections
+    problem = (lambda_0, lambda_1 * 1e-3, Beq_modal, propagators, initial_state)
+    reference = greedySequencer.GreedySequencer(*problem, use_numba=False).run()
+
+    whole = greedySequencer.GreedySequencer(*problem, pool_size=16)
+    chunked = greedySequencer.GreedySequencer(*problem, pool_size=16)
+    # A deadline far ahead only splits the selection into DEADLINE_CHECK_INTERVAL chunks
+    np.testing.assert_array_equal(whole.run(), reference)
+    np.testing.assert_array_equal(chunked.run(deadline=time.time() + 3600), reference)
+    assert chunked.stopped_at is None
+    assert chunked.refreshes == whole.refreshes
+
+
+def baseline_order(operator, Beq, steps, initial_state):
+    # The selection loop of smartScanCore before the rewrite: dense per-feature propagators,
+    # the full cost every step and an argsort filtered by the features already placed
+    order, total_features = Beq.shape
+    Ab_set = [np.linalg.matrix_power(operator, int(nt)) for nt in steps]
+    Cb = np.eye(order) - 1 / order
+    lambda_0 = np.diag(np.matmul(Beq.T, np.matmul(Cb, Beq)))
+    lambda_1 = np.zeros((total_features, order))
+    for feature in range(total_features):
+        lambda_1[feature] = 2 * np.matmul(Beq[:, feature].T, np.matmul(Cb, Ab_set[feature]))
+
+    set_opt = np.array([], dtype=int)
+    T_opt = initial_state.copy()
+    for i in range(total_features):
+        c = lambda_0 + np.dot(lambda_1, T_opt)
+        sorted_indices = np.argsort(c)
+        I = int(sorted_indices[~np.isin(sorted_indices, set_opt)][0])
+        T_opt = np.dot(Ab_set[I], T_opt) + Beq[:, I]
+        set_opt = np.append(set_opt, I)
+    return set_opt
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test_matches_the_baseline_loop(use_numba):
+    if use_numba:
+        pytest.importorskip("numba")
+    rng = np.random.default_rng(3)
+    order, total_features = 8, 120
+    Q, _ = np.linalg.qr(rng.normal(size=(order, order)))
+    operator = Q @ np.diag(rng.uniform(0.5, 0.95, order)) @ Q.T
+    steps = rng.integers(1, 10, total_features)
+    Beq = rng.uniform(0, 1, (order, total_features))
+    initial_state = rng.uniform(0, 1, order)
+
+    propagators = FeaturePropagators(operator, steps)
+    lambda_0, lambda_1 = greedySequencer.cost_terms(Beq, propagators)
+    sequencer = greedySequencer.GreedySequencer(lambda_0, lambda_1, propagators.to_modal(Beq), propagators, initial_state,
+                                                use_numba=use_numba)
+    np.testing.assert_array_equal(sequencer.run(), baseline_order(operator, Beq, steps, initial_state))
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test_exact_pruning_keeps_the_full_scan_order(use_numba):
+    if use_numba:
+        pytest.importorskip("numba")
+    problem = random_problem(features=600, order=8, seed=2)
+    reference = greedySequencer.GreedySequencer(*problem, use_numba=False).run()
+    pruned = greedySequencer.GreedySequencer(*problem, use_numba=use_numba, pool_size=16)
+    np.testing.assert_array_equal(pruned.run(), reference)
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test_approximate_pruning_stays_close_in_R(use_numba):
+    # The approximate pool picks other features at most positions, the R metric of its sequence stays within 5 %
+    if use_numba:
+        pytest.importorskip("numba")
+    problem = random_problem(features=600, order=8, seed=4)
+    exact = greedySequencer.GreedySequencer(*problem, use_numba=False)
+    approximate = greedySequencer.GreedySequencer(*problem, use_numba=use_numba, pool_size=16, pool_exact=False)
+    _, R = exact.r_metrics(np.stack([exact.run(), approximate.run()]))
+    R_exact, R_approximate = R.mean(axis=1)
+    assert R_approximate <= 1.05 * R_exact
+
+
+@pytest.mark.parametrize("symmetric", [True, False])
+def test_chunked_cost_terms_match_the_dense_definition(symmetric):
+    rng = np.random.default_rng(5)
+    order, total_features = 6, 50
+    operator = rng.uniform(0, 0.15, (order, order)) + np.diag(rng.uniform(0.3, 0.6, order))
+    if symmetric:
+        operator = (operator + operator.T) / 2
+    steps = rng.integers(1, 10, total_features)
+    Beq = rng.uniform(0, 1, (order, total_features))
+    propagators = FeaturePropagators(operator, steps)
+
+    lambda_0, lambda_1 = greedySequencer.cost_terms(Beq, propagators)
+    chunked_0, chunked_1 = greedySequencer.cost_terms(Beq, propagators, chunk=7)
+    np.testing.assert_allclose(chunked_0, lambda_0, rtol=1e-12)
+    np.testing.assert_allclose(chunked_1, lambda_1, rtol=1e-12)
+
+    # lambda_1 acts on eigenbasis coordinates, mapped back it is 2 Beq_f' Cb Final_A**Nt_f
+    Cb = np.eye(order) - 1 / order
+    np.testing.assert_allclose(lambda_0, np.diag(Beq.T @ Cb @ Beq), rtol=1e-10)
+    for feature in range(total_features):
+        expected = 2 * Beq[:, feature] @ Cb @ np.linalg.matrix_power(operator, int(steps[feature]))
+        np.testing.assert_allclose((lambda_1[feature] @ propagators.basis_inv).real, expected, rtol=1e-8, atol=1e-12)
+
+
+def test_r_metrics_match_the_in_loop_R():
+    rng = np.random.default_rng(7)
+    order, total_features, T_m = 6, 40, 1700
+    Q, _ = np.linalg.qr(rng.normal(size=(order, order)))
+    operator = Q @ np.diag(rng.uniform(0.5, 0.95, order)) @ Q.T
+    steps = rng.integers(1, 10, total_features)
+    Beq = rng.uniform(0, 100, (order, total_features))
+    initial_state = np.full(order, 293.0)
+    propagators = FeaturePropagators(operator, steps)
+    lambda_0, lambda_1 = greedySequencer.cost_terms(Beq, propagators)
+    sequencer = greedySequencer.GreedySequencer(lambda_0, lambda_1, propagators.to_modal(Beq), propagators, initial_state, T_m)
+    sequences = np.stack((sequencer.run(), np.arange(total_features)))
+
+    # The R metric the selection loop recorded after every feature before it moved to a post-pass
+    expected = np.empty((2, total_features))
+    for s, sequence in enumerate(sequences):
+        T = initial_state.copy()
+        for i, feature in enumerate(sequence):
+            T = np.linalg.matrix_power(operator, int(steps[feature])) @ T + Beq[:, feature]
+            expected[s, i] = np.std(T) / T_m
+
+    for stride, chunk in ((1, 1024), (1, 7), (3, 7)):
+        positions, R = sequencer.r_metrics(sequences, stride, chunk=chunk)
+        assert positions[-1] == total_features - 1 and np.all(np.diff(positions) == stride)
+        np.testing.assert_allclose(R, expected[:, positions], rtol=1e-9)
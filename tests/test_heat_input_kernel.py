@@ -0,0 +1,87 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.ulendohc_core.heatInputKernel import HeatInputKernel
+
+
+def test_kernel_samples_are_counted_per_voxel():
+    start, end = np.array([2.0, 3.0]), np.array([12.0, 3.0])
+    for samples_per_cell in (None, 1):
+        x, _, weight = HeatInputKernel(20, 10, samples_per_cell=samples_per_cell).sample_path(start, end, 10)
+        assert x.shape[0] == 10 and weight == 1
+
+    x, _, weight = HeatInputKernel(20, 10, samples_per_cell=0.25).sample_path(start, end, 10)
+    assert x.shape[0] == 3
+    assert x.shape[0] * weight == 10
+
+
+def test_input_matrix_stops_at_the_deadline():
+    kernel = HeatInputKernel(20, 10)
+    starts = np.tile([2.0, 3.0], (40, 1))
+    ends = np.tile([12.0, 3.0], (40, 1))
+    assert kernel.input_matrix(starts, ends, np.full(40, 10), np.arange(200), deadline=time.time() - 1) is None
+    assert kernel.stopped_at == 0
+
+    B = kernel.input_matrix(starts, ends, np.full(40, 10), np.arange(200), deadline=time.time() + 3600)
+    assert B.shape == (200, 40) and kernel.stopped_at is None
+    assert kernel.samples == 400
+
+
+def test_single_precision_input_matches_double():
+    # The kernel grid spans 0.2 per voxel, hatches far along the plate sit ~100 grid units away from it
+    rng = np.random.default_rng(0)
+    starts = np.column_stack((rng.uniform(0, 390, 50), rng.uniform(0, 40, 50)))
+    ends = starts + [6.0, 0.0]
+    steps = np.full(50, 6)
+    voxels = np.arange(400 * 40)
+
+    double = HeatInputKernel(400, 40, dtype=np.float64).input_matrix(starts, ends, steps, voxels)
+    single = HeatInputKernel(400, 40, dtype=np.float32).input_matrix(starts, ends, steps, voxels)
+
+    assert single.dtype == np.float32
+    assert np.all(np.diff(single.indptr) > 0)
+    np.testing.assert_array_equal(single.indices, double.indices)
+    np.testing.assert_allclose(single.toarray(), double.toarray(), rtol=1e-6, atol=0)
+
+
+def test_input_out_of_reach_raises():
+    kernel = HeatInputKernel(4, 4)
+    with pytest.raises(ValueError):
+        kernel.feature_input(np.array([5000.0, 0.0]), np.array([5006.0, 0.0]), 6)
+
+
+@pytest.mark.parametrize("samples_per_cell", [None, 0.25])
+def test_every_step_deposits_a_unit_of_input(samples_per_cell):
+    kernel = HeatInputKernel(30, 12, samples_per_cell=samples_per_cell)
+    starts = np.array([[2.0, 3.0], [5.0, 1.0], [20.0, 10.0]])
+    ends = np.array([[12.0, 3.0], [5.0, 9.0], [26.0, 4.0]])
+    steps = np.array([10, 8, 8])
+
+    for start, end, nt in zip(starts, ends, steps):
+        assert kernel.feature_input(start, end, nt).sum() == pytest.approx(nt, rel=1e-12)
+    # The truncated columns keep all but a sliver of the input
+    B = kernel.input_matrix(starts, ends, steps, np.arange(30 * 12))
+    np.testing.assert_allclose(np.asarray(B.sum(axis=0)).ravel(), steps, rtol=1e-3)
+
+
+def test_input_matrix_projection_matches_the_feature_loop():
+    N_x, N_y, G = 24, 10, 3.5
+    rng = np.random.default_rng(1)
+    starts = np.column_stack((rng.uniform(1, 16, 12), rng.uniform(1, 9, 12)))
+    ends = starts + [6.0, 0.0]
+    steps = np.full(12, 6)
+    voxels = np.sort(rng.choice(N_x * N_y, 200, replace=False))
+    eigen_vectors = rng.normal(size=(voxels.shape[0] + 2, 5))
+
+    kernel = HeatInputKernel(N_x, N_y)
+    B_all = kernel.input_matrix(starts, ends, steps, voxels)
+    Beq = G * (B_all.T @ eigen_vectors[:voxels.shape[0]]).T
+
+    # The loop smartScanCore ran before: one dense input per feature, padded to the node count and projected
+    for feature in range(12):
+        B_current = np.reshape(kernel.feature_input(starts[feature], ends[feature], steps[feature]), [N_x * N_y, -1])[voxels]
+        Ab1_temp = np.concatenate((B_current, np.zeros((eigen_vectors.shape[0] - B_current.shape[0], 1))))
+        expected = np.dot(np.multiply(G, eigen_vectors.T), Ab1_temp)[:, 0]
+        np.testing.assert_allclose(Beq[:, feature], expected, rtol=1e-6, atol=1e-6 * np.abs(expected).max())
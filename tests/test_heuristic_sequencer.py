@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from src.ulendohc_core import heuristicSequencer
+from src.ulendohc_core.heuristicSequencer import heuristic_order, heuristic_sequence, HEURISTIC_METHODS
+
+
+def layouts():
+    rng = np.random.default_rng(6)
+    starts = rng.uniform(0, 40, (150, 2))
+    scattered = np.column_stack((starts, starts + [3.0, 0.0], np.arange(150)))
+    # One line of hatches sharing a midpoint column, the checkerboard cells collapse to a row
+    stacked = np.array([[5.0, y, 9.0, y, i] for i, y in enumerate(np.repeat(np.arange(10.0), 3))])
+    return [np.zeros((0, 5)), scattered[:1], scattered, stacked]
+
+
+@pytest.mark.parametrize("method", HEURISTIC_METHODS)
+def test_heuristic_order_is_a_permutation(method, monkeypatch):
+    for hatches in layouts():
+        order = heuristic_order(hatches, method)
+        np.testing.assert_array_equal(np.sort(order), np.arange(hatches.shape[0]))
+
+    # Past HEURISTIC_SPREAD_MAX_FEATURES the spread falls back to the checkerboard
+    monkeypatch.setattr(heuristicSequencer, "HEURISTIC_SPREAD_MAX_FEATURES", 20)
+    hatches = layouts()[2]
+    np.testing.assert_array_equal(np.sort(heuristic_order(hatches, method)), np.arange(hatches.shape[0]))
+
+
+def test_heuristic_sequence_permutes_the_ids():
+    hatches = layouts()[2]
+    hatches[:, -1] += 1000
+    sequence = heuristic_sequence(hatches, "spread")
+    np.testing.assert_array_equal(np.sort(sequence), hatches[:, -1].astype(int))
+    with pytest.raises(ValueError):
+        heuristic_order(hatches, "raster")
@@ -0,0 +1,197 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.ulendohc_core import smartScanCore as core
+
+
+def raster_layer():
+    # 10 rows of 4 short hatches, the raster order is the trivial sequence
+    rows = []
+    for y in np.arange(2, 12, 1.0):
+        for x in range(2, 18, 4):
+            rows.append([x, y, x + 3, y, len(rows)])
+    return np.array(rows, dtype=float)
+
+
+def test_greedy_order_uses_propagation(monkeypatch):
+    captured = {}
+
+    class CapturingSequencer(core.GreedySequencer):
+        def __init__(self, lambda_0, lambda_1, Beq_modal, propagators, *args, **kwargs):
+            captured["lambda_0"] = np.asarray(lambda_0)
+            captured["scaling"] = propagators.scaling_table()
+            super().__init__(lambda_0, lambda_1, Beq_modal, propagators, *args, **kwargs)
+
+    monkeypatch.setattr(core, "GreedySequencer", CapturingSequencer)
+
+    hatches = raster_layer()
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    layers = core.stack_layers(grid, np.array([]), 2)
+    set_opt, _, R_opt, R_ori = core.smartScanCore(numbers_set=hatches, Sorted_layers=layers,
+                                                  reduced_order=10, state_cache=False)
+
+    # mu**Nt has to stay usable, an underflowed propagator reduces the greedy pick to argsort(lambda_0)
+    assert np.abs(captured["scaling"]).max() > 1e-6
+    assert not np.array_equal(set_opt, np.argsort(captured["lambda_0"], kind="stable"))
+    assert np.mean(R_opt) < np.mean(R_ori)
+
+
+def test_steps_scale_once_with_resolution(monkeypatch):
+    steps = {}
+
+    class CapturingPropagators(core.FeaturePropagators):
+        def __init__(self, operator, feature_steps):
+            steps["current"] = np.asarray(feature_steps)
+            super().__init__(operator, feature_steps)
+
+    monkeypatch.setattr(core, "FeaturePropagators", CapturingPropagators)
+
+    totals = {}
+    for resolution in (1, 2):
+        hatches = np.array([[2, 2, 42, 2, 0], [2, 6, 42, 6, 1], [2, 10, 42, 10, 2], [2, 14, 42, 14, 3]], dtype=float)
+        grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, resolution, resolution)
+        layers = core.stack_layers(grid, np.array([]), 2)
+        core.smartScanCore(numbers_set=hatches, Sorted_layers=layers, dx=resolution, dy=resolution,
+                           reduced_order=4, state_cache=False)
+        totals[resolution] = steps["current"].sum()
+
+    # The hatches are 40 mm long, one step per voxel crossed
+    assert totals[1] == 4 * 40
+    assert totals[2] == 4 * 20
+
+
+def test_diagnostics_summary_of_a_layer():
+    hatches = raster_layer()
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    layers = core.stack_layers(grid, np.array([]), 2)
+    diagnostics = {}
+    # A requested backend goes through the ladder, the raster layer would otherwise take the cosine modes
+    core.smartScanCore(numbers_set=hatches, Sorted_layers=layers, reduced_order=10, min_order=4,
+                       eigen_solver="arpack", diagnostics=diagnostics, state_cache=False)
+
+    entries = dict(entry.split(":", 1) for entry in core.diagnostics_summary(diagnostics).split(";"))
+    assert entries["sequencer"] == "greedy"
+    assert entries["eigensolver"].startswith(diagnostics["eigensolver"]["backend"])
+    assert "ladder" in entries
+    order = diagnostics["reduced_order"]
+    assert entries["order"] == f"{order['selected']}/{order['solved']}"
+
+
+def test_expired_budget_falls_back_to_the_heuristic():
+    from src.ulendohc_core.timeBudget import TimeBudget
+
+    hatches = raster_layer()
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    layers = core.stack_layers(grid, np.array([]), 2)
+    budget = TimeBudget(deadline=time.time() - 1)
+    diagnostics = {}
+    set_opt, _, R_opt, _ = core.smartScanCore(numbers_set=hatches, Sorted_layers=layers, reduced_order=10,
+                                              budget=budget, diagnostics=diagnostics, state_cache=False)
+
+    assert sorted(set_opt) == list(range(hatches.shape[0]))
+    assert R_opt == []
+    assert diagnostics["sequencer"].startswith("heuristic")
+    # The coarse quadrature never ran, so it is not reported
+    assert [record["stage"] for record in budget.degradations] == ["heat_input"]
+    assert budget.degradations[0]["action"].startswith("stopped at 0/")
+
+
+def solid_block():
+    # Rows of hatches covering a rectangle, the voxel grid adds a void margin around it
+    rows = []
+    for y in np.arange(1, 13, 1.0):
+        for x in range(1, 19, 6):
+            rows.append([x, y, x + 6, y, len(rows)])
+    hatches = np.array(rows, dtype=float)
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    return hatches, core.stack_layers(grid, np.array([]), 2)
+
+
+def test_solid_block_inside_the_margin_uses_cosine_modes():
+    hatches, layers = solid_block()
+    assert np.mean(layers != 0) < core.DCT_FILL_THRESHOLD
+    diagnostics = {}
+    core.smartScanCore(numbers_set=hatches, Sorted_layers=layers, reduced_order=10, diagnostics=diagnostics, state_cache=False)
+    assert diagnostics["eigensolver"]["backend"] == "dct"
+
+
+def test_requested_eigensolver_is_used():
+    hatches, layers = solid_block()
+    _, basis, _, _ = core.smartScanCore(numbers_set=hatches.copy(), Sorted_layers=layers, reduced_order=10, state_cache=False)
+    for eigen_solver in ("arpack", "lobpcg", "dense"):
+        # Neither the cosine modes nor the basis of the previous layer replace the requested backend
+        diagnostics = {}
+        core.smartScanCore(numbers_set=hatches.copy(), Sorted_layers=layers, reduced_order=10, v0_ev=basis,
+                           eigen_solver=eigen_solver, diagnostics=diagnostics, state_cache=False)
+        assert diagnostics["eigensolver"]["backend"] == eigen_solver
+
+
+def test_compacted_solve_matches_the_full_solve(monkeypatch):
+    solved = []
+
+    class CapturingLadder(core.EigenRetryLadder):
+        def solve(self, A, k, **kwargs):
+            solved.append(A.toarray())
+            return super().solve(A, k, **kwargs)
+
+    monkeypatch.setattr(core, "EigenRetryLadder", CapturingLadder)
+    hatches = raster_layer()
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    layers = core.stack_layers(grid, np.array([]), 2)
+    diagnostics = {}
+    _, basis, _, _ = core.smartScanCore(numbers_set=hatches.copy(), Sorted_layers=layers, reduced_order=10,
+                                        eigen_solver="dense", diagnostics=diagnostics, state_cache=False)
+    assert diagnostics["compaction"]["active"] < diagnostics["compaction"]["nodes"]
+
+    # Every node counted as active disables the compaction, the ladder then sees the full Final_A
+    monkeypatch.setattr(core.SMC, "activeNodes", lambda Sorted_layers: np.arange(np.prod(Sorted_layers.shape)))
+    core.smartScanCore(numbers_set=hatches.copy(), Sorted_layers=layers, reduced_order=10,
+                       eigen_solver="dense", state_cache=False)
+    Final_A = solved[-1]
+    assert basis.shape[0] == Final_A.shape[0]
+
+    # Scattered back to every node, the compacted basis holds the lowest eigenpairs of the full system
+    eigenvalues = np.einsum('ij,ij->j', basis, Final_A @ basis)
+    assert np.linalg.norm(Final_A @ basis - basis * eigenvalues, axis=0).max() < 1e-4
+    np.testing.assert_allclose(np.sort(eigenvalues), np.sort(np.linalg.eigvals(Final_A).real)[:10], atol=1e-8)
+
+
+def test_cropped_grid_offsets_round_trip_the_hatches():
+    rng = np.random.default_rng(4)
+    starts = rng.uniform(100, 140, (20, 2))
+    hatches = np.column_stack((starts, starts + rng.uniform(1, 5, (20, 2)), np.arange(20)))
+    original = hatches.copy()
+    dx, dy = 0.5, 0.25
+
+    grid, x_offset, y_offset = core.convert_hatch_to_voxel(hatches, 0, dx, dy)
+    restored = hatches.copy()
+    restored[:, [0, 2]] = restored[:, [0, 2]] * dx - x_offset
+    restored[:, [1, 3]] = restored[:, [1, 3]] * dy - y_offset
+    np.testing.assert_allclose(restored, original)
+
+    # The lowest hatch sits VOXEL_MARGIN voxels into the grid and every hatch is inside it
+    assert hatches[:, [0, 2]].min() == pytest.approx(core.VOXEL_MARGIN)
+    assert hatches[:, [1, 3]].min() == pytest.approx(core.VOXEL_MARGIN)
+    assert hatches[:, [0, 2]].max() < grid.shape[0] - core.VOXEL_MARGIN
+    assert hatches[:, [1, 3]].max() < grid.shape[1] - core.VOXEL_MARGIN
+    assert grid[tuple(np.ceil(hatches[:, :2]).astype(int).T) + (0,)].all()
+
+
+def test_select_modes_keeps_the_input_energy():
+    # Mode energies 50, 30, 12, 5, 2, 1 (of 100), rows in shuffled order
+    energies = np.array([5, 50, 1, 12, 30, 2], dtype=float)
+    Beq = np.sqrt(energies / 4)[:, np.newaxis] * np.array([[1.0, -1.0, 1.0, -1.0]])
+
+    kept, energy = core.select_modes(Beq, min_order=1, energy=0.9)
+    np.testing.assert_array_equal(kept, [1, 3, 4])
+    assert energy == pytest.approx(0.92)
+
+    # min_order wins over the energy and is capped by the number of modes
+    kept, energy = core.select_modes(Beq, min_order=5, energy=0.9)
+    np.testing.assert_array_equal(kept, [0, 1, 3, 4, 5])
+    assert energy == pytest.approx(0.99)
+    assert core.select_modes(Beq, min_order=10, energy=0.5)[0].shape[0] == 6
+    # Without any input the lowest min_order modes are kept
+    np.testing.assert_array_equal(core.select_modes(np.zeros((6, 4)), min_order=3)[0], [0, 1, 2])
@@ -0,0 +1,26 @@
+import numpy as np
+
+from src.ulendohc_core import smartScanCore as core
+from src.ulendohc_core.snapshotBasis import benchmark_basis_methods
+
+
+def raster_layer():
+    rows = []
+    for y in np.arange(2, 12, 1.0):
+        for x in range(2, 18, 4):
+            rows.append([x, y, x + 3, y, len(rows)])
+    hatches = np.array(rows, dtype=float)
+    grid, _, _ = core.convert_hatch_to_voxel(hatches, 0, 1, 1)
+    return hatches, core.stack_layers(grid, np.array([]), 2)
+
+
+def test_benchmark_evaluates_every_sequence_in_the_reference_basis():
+    hatches, layers = raster_layer()
+    results = benchmark_basis_methods(hatches, layers, methods=("eigen", "pod"), reduced_order=10)
+
+    _, _, R_opt, R_ori = core.smartScanCore(numbers_set=hatches.copy(), Sorted_layers=layers, reduced_order=10, state_cache=False)
+    assert results["eigen"]["R_opt"] == np.mean(R_opt)
+    assert results["eigen"]["matches"] == 1.0
+    # Every R is measured against the same original order in the same basis, so they share a scale
+    assert results["pod"]["R_ori"] == results["eigen"]["R_ori"] == np.mean(R_ori)
+    assert 0.5 < results["pod"]["R_opt"] / results["eigen"]["R_opt"] < 2
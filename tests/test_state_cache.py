@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+from scipy.sparse import identity
+
+from src.ulendohc_core.stateCache import StateCache, state_key
+
+
+def test_key_follows_the_mask_grid_and_convection():
+    mask = np.zeros((6, 5, 2))
+    mask[1:4, 1:4, :] = 1
+    base = state_key(mask, 0.1, 0.1, 0.2, 0.3, 0.01)
+    assert state_key(mask.copy(), 0.1, 0.1, 0.2, 0.3, 0.01) == base
+
+    changed = mask.copy()
+    changed[4, 1, 0] = 1
+    assert state_key(changed, 0.1, 0.1, 0.2, 0.3, 0.01) != base
+    assert state_key(mask, 0.2, 0.1, 0.2, 0.3, 0.01) != base
+    assert state_key(mask, 0.1, 0.1, 0.2, 0.3, 0.02) != base
+    # Only the mask is keyed, not the values of the voxels
+    assert state_key(mask * 3, 0.1, 0.1, 0.2, 0.3, 0.01) == base
+
+
+def test_evicts_the_least_recently_used_entry(tmp_path):
+    cache = StateCache(str(tmp_path), size_cap=2**40)
+    matrix, voxels = identity(50, format="csr"), np.arange(10)
+    for key in ("a", "b", "c"):
+        cache.store_matrix(key, matrix, voxels)
+    entry_size = cache.size() / 3
+    for age, key in enumerate(("a", "b", "c")):
+        os.utime(cache.entry_path(key), (100 * (age + 1), 100 * (age + 1)))
+
+    # A hit makes "a" the most recently used, "b" is now the oldest
+    assert cache.load_matrix("a") is not None
+    cache.size_cap = 3.5 * entry_size
+    cache.store_matrix("d", matrix, voxels)
+
+    assert sorted(key for _, _, key in cache.entries()) == ["a", "c", "d"]
+    assert cache.load_matrix("b") is None
+
+
+def test_stores_below_the_cap_do_not_rescan(tmp_path):
+    cache = StateCache(str(tmp_path), size_cap=2**40)
+    scans = []
+    entries = cache.entries
+    cache.entries = lambda: scans.append(1) or entries()
+
+    cache.store_matrix("a", identity(20, format="csr"), np.arange(4))
+    cache.store_basis("a", 3, np.ones((20, 3)))
+    cache.store_basis("a", 3, np.ones((20, 3)))
+    assert scans == []
+    assert cache._size == sum(size for _, size, _ in entries())
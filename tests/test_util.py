@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from src.ulendohc_core.heatInputKernel import HeatInputKernel
+from src.ulendohc_core.util import SOLVER_PRESETS, SOLVER_SETTINGS, solver_preset
+
+
+def test_solver_preset_override_of_preset_key():
+    settings = solver_preset("draft", precision="double", heuristic_threshold=3)
+    assert settings["precision"] == "double"
+    assert settings["heuristic_threshold"] == 3
+    assert settings["eigen_retries"] == SOLVER_PRESETS["draft"]["eigen_retries"]
+    assert set(settings) == set(SOLVER_SETTINGS)
+
+
+def test_solver_preset_rejects_unknown():
+    with pytest.raises(ValueError):
+        solver_preset("fastest")
+    with pytest.raises(ValueError):
+        solver_preset("draft", tolerance=1e-3)
+
+
+def test_tiling_is_off_by_default():
+    for name in SOLVER_PRESETS:
+        assert solver_preset(name)["tile_size_mm"] is None
+
+
+def test_preset_mappings():
+    # balanced is the previous behaviour, every layer of 3 or more hatches goes through the reduced model
+    assert solver_preset("balanced") == SOLVER_SETTINGS
+    assert SOLVER_SETTINGS["heuristic_threshold"] == 3
+    assert SOLVER_SETTINGS["kernel_samples"] is None
+
+    draft = solver_preset("draft")
+    assert draft["resolution"] == 2 and draft["precision"] == "single"
+    assert draft["heuristic_threshold"] == 50 and draft["greedy_pruning"] == "approximate"
+
+    thorough = solver_preset("thorough")
+    assert thorough["objective_layers"] == 3
+    assert thorough["reduced_order_max"] > SOLVER_SETTINGS["reduced_order_max"]
+    assert thorough["eigen_retries"] > SOLVER_SETTINGS["eigen_retries"]
+
+
+def test_draft_kernel_drops_samples():
+    kernel = HeatInputKernel(30, 10, samples_per_cell=solver_preset("draft")["kernel_samples"])
+    x, _, _ = kernel.sample_path(np.array([2.0, 3.0]), np.array([22.0, 3.0]), 20)
+    assert x.shape[0] < 20